@@ -0,0 +1,310 @@
+"""In-memory stand-ins for Redis, Yahoo Finance and Discord used by the benchmarks.
+
+Each fake can inject latency, and the price provider can also inject
+failures, so runs are reproducible without network access.
+"""
+import asyncio
+import fnmatch
+import random
+import threading
+import time
+import zlib
+from collections import Counter, defaultdict
+from contextlib import contextmanager
+from datetime import date, datetime, timedelta
+
+import interactions
+import numpy as np
+import pandas as pd
+
+from internal.redis_connector.funcs import BUMP_ALERTS_VERSION_SCRIPT
+from internal.stocks import price_provider
+from internal.stocks.price_provider import PriceProvider
+
+
+def _encode(value) -> bytes:
+    if isinstance(value, bytes):
+        return value
+    if isinstance(value, str):
+        return value.encode("utf-8")
+    return str(value).encode("utf-8")
+
+
+class FakeRedis:
+    """The subset of redis-py's asyncio client the bot uses, kept in memory.
+    Each round trip awaits `latency` seconds."""
+
+    def __init__(self, latency: float = 0.0):
+        self.latency = latency
+        self.round_trips = 0
+        self._data: dict[bytes, object] = {}
+
+    async def _round_trip(self):
+        self.round_trips += 1
+        if self.latency:
+            await asyncio.sleep(self.latency)
+
+    async def _call(self, command: str, *args, **kwargs):
+        await self._round_trip()
+        return getattr(self, "_" + command)(*args, **kwargs)
+
+    def __getattr__(self, command: str):
+        if not hasattr(type(self), "_" + command):
+            raise AttributeError(command)
+        return lambda *args, **kwargs: self._call(command, *args, **kwargs)
+
+    def pipeline(self, transaction: bool = True) -> "FakePipeline":
+        return FakePipeline(self)
+
+    async def scan_iter(self, match: str = None, **kwargs):
+        await self._round_trip()
+        for key in list(self._data):
+            if match is None or fnmatch.fnmatchcase(key.decode("utf-8"), match):
+                yield key
+
+    # strings
+
+    def _get(self, name):
+        return self._data.get(_encode(name))
+
+    def _set(self, name, value, ex=None, **kwargs):
+        self._data[_encode(name)] = _encode(value)
+        return True
+
+    def _exists(self, *names):
+        return sum(_encode(name) in self._data for name in names)
+
+    def _delete(self, *names):
+        return sum(self._data.pop(_encode(name), None) is not None for name in names)
+
+    def _expire(self, name, seconds):
+        return _encode(name) in self._data
+
+    def _incr(self, name):
+        value = int(self._data.get(_encode(name), 0)) + 1
+        self._data[_encode(name)] = _encode(value)
+        return value
+
+    # scripts, emulated in Python
+
+    def _eval(self, script, numkeys, *keys_and_args):
+        keys, args = keys_and_args[:numkeys], keys_and_args[numkeys:]
+        if script == BUMP_ALERTS_VERSION_SCRIPT:
+            if _encode(args[0]) in self._data.get(_encode(keys[0]), set()):
+                return self._incr(keys[1])
+            return 0
+        raise NotImplementedError("script not emulated")
+
+    # hashes
+
+    def _hash(self, name) -> dict:
+        return self._data.setdefault(_encode(name), {})
+
+    def _hset(self, name, key=None, value=None, mapping=None):
+        items = dict(mapping or {})
+        if key is not None:
+            items[key] = value
+        fields = self._hash(name)
+        added = 0
+        for field, field_value in items.items():
+            added += _encode(field) not in fields
+            fields[_encode(field)] = _encode(field_value)
+        return added
+
+    def _hget(self, name, key):
+        return self._data.get(_encode(name), {}).get(_encode(key))
+
+    def _hmget(self, name, keys, *args):
+        fields = self._data.get(_encode(name), {})
+        return [fields.get(_encode(key)) for key in list(keys) + list(args)]
+
+    def _hgetall(self, name):
+        return dict(self._data.get(_encode(name), {}))
+
+    def _hdel(self, name, *keys):
+        fields = self._data.get(_encode(name), {})
+        return sum(fields.pop(_encode(key), None) is not None for key in keys)
+
+    # sets
+
+    def _sadd(self, name, *values):
+        members = self._data.setdefault(_encode(name), set())
+        added = len(members)
+        members.update(_encode(value) for value in values)
+        return len(members) - added
+
+    def _srem(self, name, *values):
+        members = self._data.get(_encode(name), set())
+        removed = len(members)
+        members.difference_update(_encode(value) for value in values)
+        return removed - len(members)
+
+    def _smembers(self, name):
+        return set(self._data.get(_encode(name), set()))
+
+    # sorted sets
+
+    def _zadd(self, name, mapping):
+        scores = self._data.setdefault(_encode(name), {})
+        added = 0
+        for member, score in mapping.items():
+            added += _encode(member) not in scores
+            scores[_encode(member)] = float(score)
+        return added
+
+    def _zrangebyscore(self, name, min, max):
+        scores = self._data.get(_encode(name), {})
+        return [
+            member for member, score in sorted(scores.items(), key=lambda item: item[1])
+            if float(min) <= score <= float(max)
+        ]
+
+    def _zremrangebyscore(self, name, min, max):
+        scores = self._data.get(_encode(name), {})
+        removed = [m for m, score in scores.items() if float(min) <= score <= float(max)]
+        for member in removed:
+            del scores[member]
+        return len(removed)
+
+
+class FakePipeline:
+    """Queues commands and runs them in a single round trip on execute()."""
+
+    def __init__(self, r: FakeRedis):
+        self.r = r
+        self._commands: list[tuple[str, tuple, dict]] = []
+
+    def __getattr__(self, command: str):
+        if not hasattr(FakeRedis, "_" + command):
+            raise AttributeError(command)
+
+        def queue(*args, **kwargs):
+            self._commands.append((command, args, kwargs))
+            return self
+        return queue
+
+    async def execute(self) -> list:
+        await self.r._round_trip()
+        results = [
+            getattr(self.r, "_" + command)(*args, **kwargs)
+            for command, args, kwargs in self._commands
+        ]
+        self._commands.clear()
+        return results
+
+
+class FakePriceProvider(PriceProvider):
+    """Deterministic prices shaped like yfinance's output. Calls still go
+    through PriceProvider.run/run_serial, so timeouts, retries and the
+    serialized downloads are exercised."""
+
+    def __init__(self, latency: float = 0.0, failure_rate: float = 0.0, seed: int = 0, **kwargs):
+        kwargs.setdefault("backoff", 0.01)
+        super().__init__(**kwargs)
+        self.latency = latency
+        self.failure_rate = failure_rate
+        self.calls = Counter()
+        self._random = random.Random(seed)
+        self._lock = threading.Lock()
+
+    def _simulate(self, call: str):
+        with self._lock:
+            self.calls[call] += 1
+            jitter = self._random.random()
+            fails = self._random.random() < self.failure_rate
+        if self.latency:
+            time.sleep(self.latency * (0.5 + jitter))
+        if fails:
+            raise ConnectionError(f"injected {call} failure")
+
+    @staticmethod
+    def closes(ticker: str, days: pd.DatetimeIndex) -> np.ndarray:
+        seed = zlib.crc32(ticker.encode("utf-8"))
+        base = 5 + seed % 500
+        ordinals = np.array([d.toordinal() for d in days], dtype=np.float64)
+        return (base * (1 + 0.05 * np.sin(ordinals / 7 + seed % 13))).round(2)
+
+    def _download(self, tickers, start=None, end=None, period=None, **kwargs) -> pd.DataFrame:
+        self._simulate("download")
+        today = date.today()
+        if period is not None:
+            days = pd.bdate_range(end=today, periods=int(period.rstrip("d")))
+        else:
+            start = start.date() if isinstance(start, datetime) else start
+            end = end.date() if isinstance(end, datetime) else end
+            # yfinance's end is exclusive
+            days = pd.bdate_range(start=start, end=(end or today + timedelta(days=1)) - timedelta(days=1))
+        days.name = "Date"
+
+        if isinstance(tickers, str):
+            return pd.DataFrame({"Close": self.closes(tickers, days)}, index=days)
+        columns = pd.MultiIndex.from_product([["Close"], tickers])
+        return pd.DataFrame(
+            np.column_stack([self.closes(t, days) for t in tickers]) if tickers else None,
+            index=days,
+            columns=columns,
+        )
+
+    def _last_price(self, ticker: str) -> float:
+        self._simulate("last_price")
+        return float(self.closes(ticker, pd.DatetimeIndex([date.today()]))[0])
+
+    def _info(self, ticker: str) -> dict:
+        self._simulate("info")
+        return {"longName": f"{ticker} Holdings"}
+
+    async def download(self, tickers: str | list[str], **kwargs) -> pd.DataFrame:
+        return await self.run_serial(self._download, tickers, **kwargs)
+
+    async def get_last_price(self, ticker: str) -> float:
+        return await self.run(self._last_price, ticker)
+
+    async def get_info(self, ticker: str) -> dict:
+        return await self.run(self._info, ticker)
+
+    @contextmanager
+    def installed(self):
+        """Serves every get_provider() caller from this provider."""
+        original = price_provider._provider
+        price_provider._provider = self
+        try:
+            yield self
+        finally:
+            price_provider._provider = original
+
+
+class StubChannel:
+    def __init__(self, discord: "StubDiscord", channel_id):
+        self.discord = discord
+        self.id = channel_id
+
+    async def send(self, content: str = None, files=None, **kwargs):
+        self.discord.calls["send"] += 1
+        self.discord.sends[str(self.id)] += 1
+        if self.discord.latency:
+            await asyncio.sleep(self.discord.latency)
+
+
+class StubDiscord:
+    """Replaces `interactions.get` so channel lookups and sends stay local.
+    Pass the instance wherever the bot client is expected."""
+
+    def __init__(self, latency: float = 0.0):
+        self.latency = latency
+        self.calls = Counter()
+        self.sends: dict[str, int] = defaultdict(int)
+
+    async def get(self, client, obj, object_id=None, **kwargs):
+        self.calls["get_channel"] += 1
+        if self.latency:
+            await asyncio.sleep(self.latency)
+        return StubChannel(self, object_id)
+
+    @contextmanager
+    def installed(self):
+        original = interactions.get
+        interactions.get = self.get
+        try:
+            yield self
+        finally:
+            interactions.get = original
@@ -0,0 +1,70 @@
+"""Compares the Plotly/Kaleido and Pillow table renderers.
+
+Usage: python -m benchmarks.render_benchmark [rows] [iterations]
+"""
+import sys
+import time
+import tracemalloc
+
+import numpy as np
+import pandas as pd
+
+from internal.stocks.helpers import RENDERERS
+
+HEADERS = [
+    "Ticker",
+    "Book Cost",
+    "Current Price",
+    "$ Δ Inception",
+    "ROI Inception",
+    "$ Δ Weekly",
+    "% Δ Weekly",
+]
+
+
+def synthetic_table(rows: int, seed: int = 0) -> pd.DataFrame:
+    rng = np.random.default_rng(seed)
+    book = rng.uniform(5, 500, rows).round(2)
+    price = (book * rng.uniform(0.5, 1.5, rows)).round(2)
+    week = (price * rng.uniform(0.9, 1.1, rows)).round(2)
+    return pd.DataFrame(
+        {
+            "Ticker": [f"T{i:03d}" for i in range(rows)],
+            "Book Cost": book,
+            "Current Price": price,
+            "$ Δ Inception": (price - book).round(2),
+            "ROI Inception": ((price - book) / book * 100).round(2),
+            "$ Δ Weekly": (price - week).round(2),
+            "% Δ Weekly": ((price - week) / week * 100).round(2),
+        },
+        columns=HEADERS,
+    )
+
+
+def bench(name: str, rows: int, iterations: int):
+    render = RENDERERS[name]
+    df = synthetic_table(rows)
+    render(df.copy())  # warm up
+
+    tracemalloc.start()
+    timings = []
+    for _ in range(iterations):
+        start = time.perf_counter()
+        png = render(df.copy())
+        timings.append(time.perf_counter() - start)
+    _, peak = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+
+    timings = np.array(timings) * 1000
+    print(
+        f"{name:>7}: mean {timings.mean():8.2f}ms  p50 {np.percentile(timings, 50):8.2f}ms  "
+        f"p95 {np.percentile(timings, 95):8.2f}ms  py peak {peak / 1024:8.1f}KiB  png {len(png) / 1024:6.1f}KiB"
+    )
+
+
+if __name__ == "__main__":
+    rows = int(sys.argv[1]) if len(sys.argv) > 1 else 10
+    iterations = int(sys.argv[2]) if len(sys.argv) > 2 else 20
+    print(f"{rows} rows, {iterations} iterations (Kaleido's browser memory is not traced)")
+    for name in RENDERERS:
+        bench(name, rows, iterations)
@@ -0,0 +1,232 @@
+"""Drives the weekly notification path end to end against local fakes.
+
+A synthetic population of users is written to an in-memory Redis, prices
+come from a deterministic provider and Discord is stubbed, so results are
+comparable between runs. Save a run with --save and pass it to a later
+run with --baseline to see the change per stage.
+
+Usage: python -m benchmarks.weekly_benchmark --users 1000 --tickers-per-user 10
+"""
+import argparse
+import asyncio
+import io
+import json
+import os
+import random
+import time
+from datetime import datetime
+
+import numpy as np
+
+from benchmarks.fakes import FakePriceProvider, FakeRedis, StubDiscord
+from internal.funcs.metrics import metrics
+from internal.redis_connector import funcs as rds
+from internal.redis_connector.data_types import TrackedStock
+from internal.stocks import (channel_cache, helpers, notifications,
+                             price_cache, price_history)
+from internal.stocks.price_cache import PriceCache
+from internal.stocks.render_pool import get_render_pool
+from internal.stocks.stock_functions import get_weekly_closes
+
+
+def parse_args() -> argparse.Namespace:
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--users", type=int, default=500)
+    parser.add_argument("--tickers-per-user", type=int, default=8)
+    parser.add_argument("--universe", type=int, default=300, help="distinct tickers across all users")
+    parser.add_argument("--channels", type=int, default=50, help="distinct channels users are pinged in")
+    parser.add_argument("--sample", type=int, default=50, help="users timed in the per-user stages")
+    parser.add_argument("--yahoo-latency", type=float, default=0.0, help="mean seconds per Yahoo call")
+    parser.add_argument("--yahoo-failure-rate", type=float, default=0.0)
+    parser.add_argument("--redis-latency", type=float, default=0.0, help="seconds per Redis round trip")
+    parser.add_argument("--discord-latency", type=float, default=0.0, help="seconds per Discord call")
+    parser.add_argument("--renderer", default=os.getenv("TABLE_RENDERER", "pil"))
+    parser.add_argument("--warm-up", action="store_true", help="run the pre-send warm-up before the weekly send")
+    parser.add_argument("--seed", type=int, default=0)
+    parser.add_argument("--save", help="write results as JSON to this path")
+    parser.add_argument("--baseline", help="compare against results saved with --save")
+    return parser.parse_args()
+
+
+def summarize(timings: list[float], wall: float = None) -> dict:
+    """Latency percentiles in milliseconds and throughput per second."""
+    if not timings:
+        return {"n": 0}
+    ms = np.array(timings) * 1000
+    wall = wall if wall is not None else sum(timings)
+    return {
+        "n": len(timings),
+        "mean_ms": ms.mean(),
+        "p50_ms": np.percentile(ms, 50),
+        "p90_ms": np.percentile(ms, 90),
+        "p99_ms": np.percentile(ms, 99),
+        "max_ms": ms.max(),
+        "per_second": len(timings) / wall if wall else float("inf"),
+    }
+
+
+def print_stage(name: str, stats: dict, baseline: dict = None):
+    if not stats.get("n"):
+        print(f"{name:>30}: no samples")
+        return
+    line = (
+        f"{name:>30}: n {stats['n']:5d}  p50 {stats['p50_ms']:9.2f}ms  p90 {stats['p90_ms']:9.2f}ms  "
+        f"p99 {stats['p99_ms']:9.2f}ms  max {stats['max_ms']:9.2f}ms  {stats['per_second']:9.1f}/s"
+    )
+    if baseline and baseline.get("n"):
+        line += "  (p50 {:+.1f}%, rate {:+.1f}%)".format(
+            (stats["p50_ms"] / baseline["p50_ms"] - 1) * 100,
+            (stats["per_second"] / baseline["per_second"] - 1) * 100,
+        )
+    print(line)
+
+
+async def populate(r: FakeRedis, args: argparse.Namespace) -> list[bytes]:
+    rng = random.Random(args.seed)
+    universe = [f"T{i:04d}" for i in range(args.universe)]
+    channels = [900_000 + i for i in range(args.channels)]
+    start_date = str(datetime.today().date())
+    for i in range(args.users):
+        await rds.add_stocks_to_user(
+            r=r,
+            discord_id=100_000 + i,
+            tracked_stocks=[
+                TrackedStock(
+                    ticker=ticker,
+                    discord_channel=rng.choice(channels),
+                    book_cost=rng.uniform(5, 500),
+                    start_date=start_date,
+                )
+                for ticker in rng.sample(universe, min(args.tickers_per_user, len(universe)))
+            ],
+        )
+    return await rds.get_all_discord_ids(r=r)
+
+
+async def reset_caches(r: FakeRedis):
+    """Drops cached prices, stored history, rendered images and channels so each stage starts cold."""
+    async for key in r.scan_iter(match="PRICE*"):
+        await r.delete(key)
+    price_cache._cache = None
+    price_cache.attach_redis(r)
+    price_history.attach_redis(r)
+    helpers._image_cache = PriceCache(max_size=helpers._image_cache.max_size, name="image")
+    channel_cache._channel_cache = None
+
+
+async def timed(fn, *args, **kwargs) -> float:
+    start = time.perf_counter()
+    await fn(*args, **kwargs)
+    return time.perf_counter() - start
+
+
+async def run(args: argparse.Namespace) -> dict:
+    os.environ["TABLE_RENDERER"] = args.renderer
+    r = FakeRedis()
+    discord = StubDiscord(latency=args.discord_latency)
+    provider = FakePriceProvider(
+        latency=args.yahoo_latency,
+        failure_rate=args.yahoo_failure_rate,
+        seed=args.seed,
+    )
+    results: dict[str, dict] = {}
+
+    start = time.perf_counter()
+    discord_ids = await populate(r, args)
+    print(f"populated {len(discord_ids)} users in {time.perf_counter() - start:.2f}s")
+    r.latency = args.redis_latency
+
+    sample = random.Random(args.seed).sample(discord_ids, min(args.sample, len(discord_ids)))
+    users = await rds.get_users(r=r, discord_ids=sample)
+    get_render_pool()  # start workers outside the timed stages
+
+    with provider.installed(), discord.installed():
+        await reset_caches(r)
+        start = time.perf_counter()
+        prices = await get_weekly_closes([t for user in users for t in user.stocks])
+        results["get_weekly_closes"] = summarize([time.perf_counter() - start])
+
+        timings, tables = [], []
+        for user in users:
+            start = time.perf_counter()
+            tables.append(await notifications.build_weekly_table(user=user, prices=prices))
+            timings.append(time.perf_counter() - start)
+        results["build_weekly_table"] = summarize(timings)
+
+        timings = []
+        for table, _ in tables:
+            with io.BytesIO() as buffer:
+                timings.append(await timed(helpers.create_update_table, buffer, table))
+        results["create_update_table"] = summarize(timings)
+
+        await reset_caches(r)
+        timings = [
+            await timed(notifications.stock_update_user, discord, r, id)
+            for id in sample
+        ]
+        results["stock_update_user"] = summarize(timings)
+
+        await reset_caches(r)
+        provider.calls.clear()
+        discord.calls.clear()
+        round_trips = r.round_trips
+        run_id = f"bench-{time.time_ns()}"
+        if args.warm_up:
+            results["warm_up"] = summarize(
+                [await timed(notifications.warm_up_weekly_notifications, r, run_id)])
+
+        # time each user inside the real fan-out
+        stock_update_user = notifications.stock_update_user
+        per_user: list[float] = []
+
+        async def timed_update(*a, **kw):
+            per_user.append(await timed(stock_update_user, *a, **kw))
+
+        notifications.stock_update_user = timed_update
+        try:
+            start = time.perf_counter()
+            await notifications.send_weekly_notifications(discord, r, run_id=run_id)
+            wall = time.perf_counter() - start
+        finally:
+            notifications.stock_update_user = stock_update_user
+        results["send_weekly_notifications"] = summarize(per_user, wall=wall)
+
+    get_render_pool().shutdown()
+    provider.shutdown()
+    notified = max(len(per_user), 1)
+    results["calls_per_user"] = {
+        "yahoo": sum(provider.calls.values()) / notified,
+        "redis": (r.round_trips - round_trips) / notified,
+        "discord": sum(discord.calls.values()) / notified,
+    }
+    results["metrics"] = json.loads(metrics.to_json())
+    return results
+
+
+def main():
+    args = parse_args()
+    results = asyncio.run(run(args))
+    baseline = {}
+    if args.baseline:
+        with open(args.baseline) as f:
+            baseline = json.load(f)["results"]
+
+    print(
+        f"\n{args.users} users x {args.tickers_per_user} tickers, {args.universe} distinct, "
+        f"renderer {args.renderer}")
+    for name, stats in results.items():
+        if name not in ("calls_per_user", "metrics"):
+            print_stage(name, stats, baseline.get(name))
+    calls = results["calls_per_user"]
+    print(
+        f"{'calls per notified user':>30}: yahoo {calls['yahoo']:.2f}  "
+        f"redis {calls['redis']:.2f}  discord {calls['discord']:.2f}")
+
+    if args.save:
+        with open(args.save, "w") as f:
+            json.dump({"args": vars(args), "results": results}, f, indent=2, default=float)
+        print(f"saved to {args.save}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,127 @@
+import asyncio
+import json
+import os
+import threading
+import time
+from collections import defaultdict
+from contextlib import contextmanager
+
+PREFIX = "stock_tracker_"
+
+
+def _label_key(labels: dict) -> tuple:
+    return tuple(sorted(labels.items()))
+
+
+def _format_labels(key: tuple) -> str:
+    if not key:
+        return ""
+    return "{" + ",".join(f'{k}="{v}"' for k, v in key) + "}"
+
+
+class Metrics:
+    """Counters and per-stage span timings, exported as Prometheus text or JSON."""
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self.counters: dict[str, dict[tuple, float]] = defaultdict(lambda: defaultdict(float))
+        # stage -> labels -> [count, total seconds, max seconds]
+        self.spans: dict[str, dict[tuple, list[float]]] = defaultdict(lambda: defaultdict(lambda: [0, 0.0, 0.0]))
+
+    def inc(self, name: str, value: float = 1, **labels):
+        with self._lock:
+            self.counters[name][_label_key(labels)] += value
+
+    def observe(self, stage: str, seconds: float, **labels):
+        with self._lock:
+            span = self.spans[stage][_label_key(labels)]
+            span[0] += 1
+            span[1] += seconds
+            span[2] = max(span[2], seconds)
+
+    @contextmanager
+    def span(self, stage: str, **labels):
+        """Times the enclosed block as one `stage` span."""
+        start = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.observe(stage, time.perf_counter() - start, **labels)
+
+    def to_prometheus(self) -> str:
+        lines = []
+        with self._lock:
+            for name, series in sorted(self.counters.items()):
+                lines.append(f"# TYPE {PREFIX}{name} counter")
+                for key, value in series.items():
+                    lines.append(f"{PREFIX}{name}{_format_labels(key)} {value}")
+            if self.spans:
+                lines.append(f"# TYPE {PREFIX}span_seconds summary")
+            for stage, series in sorted(self.spans.items()):
+                for key, (count, total, longest) in series.items():
+                    labels = _format_labels((("stage", stage),) + key)
+                    lines.append(f"{PREFIX}span_seconds_count{labels} {count}")
+                    lines.append(f"{PREFIX}span_seconds_sum{labels} {total}")
+                    lines.append(f"{PREFIX}span_seconds_max{labels} {longest}")
+        return "\n".join(lines) + "\n"
+
+    def to_json(self) -> str:
+        with self._lock:
+            return json.dumps({
+                "counters": {
+                    name: {_format_labels(key) or "total": value for key, value in series.items()}
+                    for name, series in self.counters.items()
+                },
+                "spans": {
+                    stage: {
+                        _format_labels(key) or "total": {"count": count, "sum": total, "max": longest}
+                        for key, (count, total, longest) in series.items()
+                    }
+                    for stage, series in self.spans.items()
+                },
+            })
+
+    def write_file(self, path: str):
+        content = self.to_json() if path.endswith(".json") else self.to_prometheus()
+        tmp = path + ".tmp"
+        with open(tmp, "w") as f:
+            f.write(content)
+        os.replace(tmp, path)
+
+    async def export_loop(self, path: str, interval: float = 15):
+        while True:
+            await asyncio.sleep(interval)
+            self.write_file(path)
+
+    async def serve(self, port: int, host: str = "127.0.0.1") -> asyncio.AbstractServer:
+        """Serves `/metrics` (Prometheus text) and `/metrics.json` over plain HTTP."""
+        async def handle(reader: asyncio.StreamReader, writer: asyncio.StreamWriter):
+            request = await reader.readline()
+            while (await reader.readline()).strip():
+                pass  # skip headers
+            path = request.split(b" ")[1] if request.count(b" ") >= 2 else b"/"
+            if path == b"/metrics.json":
+                body, content_type = self.to_json(), "application/json"
+            else:
+                body, content_type = self.to_prometheus(), "text/plain; version=0.0.4"
+            body = body.encode("utf-8")
+            writer.write(
+                f"HTTP/1.1 200 OK\r\nContent-Type: {content_type}\r\n"
+                f"Content-Length: {len(body)}\r\nConnection: close\r\n\r\n".encode("utf-8") + body)
+            await writer.drain()
+            writer.close()
+
+        return await asyncio.start_server(handle, host, port)
+
+
+metrics = Metrics()
+
+
+async def start_exporters():
+    """Starts the exporters configured by METRICS_FILE and METRICS_PORT."""
+    tasks = []
+    if os.getenv("METRICS_FILE"):
+        tasks.append(asyncio.create_task(metrics.export_loop(os.getenv("METRICS_FILE"))))
+    if os.getenv("METRICS_PORT"):
+        await metrics.serve(int(os.getenv("METRICS_PORT")))
+    return tasks
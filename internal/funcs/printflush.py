@@ -1,6 +1,75 @@
+import atexit
+import json
+import logging
+import os
 import sys
+import threading
+import time
+from datetime import datetime, timezone
 
 
-def printFlush(t: str) -> None:
-    print(t)
-    sys.stdout.flush()
\ No newline at end of file
+class JsonFormatter(logging.Formatter):
+    def format(self, record: logging.LogRecord) -> str:
+        entry = {
+            "ts": datetime.fromtimestamp(record.created, tz=timezone.utc).isoformat(),
+            "level": record.levelname,
+            "msg": record.getMessage(),
+        }
+        entry.update(getattr(record, "fields", {}))
+        if record.exc_info:
+            entry["exc"] = self.formatException(record.exc_info)
+        return json.dumps(entry, default=str, ensure_ascii=False)
+
+
+class BufferedStreamHandler(logging.Handler):
+    """Collects formatted lines and writes them in one batch, flushing when
+    the buffer fills, on errors, or every `interval` seconds."""
+
+    def __init__(self, stream=sys.stdout, capacity: int = 200, interval: float = 2.0):
+        super().__init__()
+        self.stream = stream
+        self.capacity = capacity
+        self._buffer: list[str] = []
+        flusher = threading.Thread(target=self._flush_every, args=(interval,), daemon=True)
+        flusher.start()
+
+    def emit(self, record: logging.LogRecord):
+        try:
+            line = self.format(record)
+        except Exception:
+            self.handleError(record)
+            return
+        with self.lock:
+            self._buffer.append(line)
+            full = len(self._buffer) >= self.capacity
+        if full or record.levelno >= logging.ERROR:
+            self.flush()
+
+    def flush(self):
+        with self.lock:
+            if not self._buffer:
+                return
+            self.stream.write("\n".join(self._buffer) + "\n")
+            self._buffer.clear()
+            self.stream.flush()
+
+    def _flush_every(self, interval: float):
+        while True:
+            time.sleep(interval)
+            self.flush()
+
+
+logger = logging.getLogger("stock_tracker")
+logger.setLevel(logging.INFO)
+logger.propagate = False
+_handler = BufferedStreamHandler(
+    interval=float(os.getenv("LOG_FLUSH_SECONDS", 2)))
+if os.getenv("LOG_FORMAT", "json") == "json":
+    _handler.setFormatter(JsonFormatter())
+logger.addHandler(_handler)
+atexit.register(_handler.flush)
+
+
+def printFlush(t: str, **fields) -> None:
+    """Logs a line, with optional structured fields, through the buffered handler."""
+    logger.info(t, extra={"fields": fields})
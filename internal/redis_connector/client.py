@@ -0,0 +1,29 @@
+import os
+
+from redis.asyncio import BlockingConnectionPool, Redis
+from redis.asyncio.retry import Retry
+from redis.backoff import ExponentialBackoff
+from redis.exceptions import ConnectionError, TimeoutError
+
+
+def create_redis() -> Redis:
+    """Async client on a bounded connection pool, configured from the environment.
+
+    Idle connections are health checked before reuse, and commands that hit
+    a dropped connection reconnect and retry with backoff.
+    """
+    pool = BlockingConnectionPool(
+        host=os.getenv("REDIS_HOST"),
+        port=int(os.getenv("REDIS_PORT", 6379)),
+        password=os.getenv("REDIS_PASSWORD"),
+        max_connections=int(os.getenv("REDIS_MAX_CONNECTIONS", 32)),
+        # seconds to wait for a free connection when all are in use
+        timeout=float(os.getenv("REDIS_POOL_TIMEOUT", 10)),
+        socket_timeout=float(os.getenv("REDIS_SOCKET_TIMEOUT", 5)),
+        socket_connect_timeout=float(os.getenv("REDIS_CONNECT_TIMEOUT", 5)),
+        socket_keepalive=True,
+        health_check_interval=int(os.getenv("REDIS_HEALTH_CHECK_INTERVAL", 30)),
+        retry=Retry(ExponentialBackoff(cap=2, base=0.1), int(os.getenv("REDIS_RETRIES", 3))),
+        retry_on_error=[ConnectionError, TimeoutError],
+    )
+    return Redis(connection_pool=pool)
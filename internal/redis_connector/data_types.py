@@ -1,6 +1,16 @@
-from dataclasses import asdict, dataclass
+import json
+import struct
+from dataclasses import asdict, dataclass, field
 from datetime import datetime
 
+# v1 record: version byte, channel (uint64), book cost (float64), start date (utf-8)
+TRACKED_STOCK_V1 = 1
+TRACKED_STOCK_V1_HEADER = struct.Struct("<BQd")
+# v1 alert: version byte, threshold (float64), channel (uint64)
+PRICE_ALERT_V1 = 1
+PRICE_ALERT_V1_FORMAT = struct.Struct("<BdQ")
+ALERT_KINDS = ("above", "below", "move")
+
 
 @dataclass
 class TrackedStock:
@@ -12,8 +22,78 @@ class TrackedStock:
     def to_dict(self):
         return asdict(self)
 
+    def to_bytes(self) -> bytes:
+        """Compact v1 encoding. The ticker is the hash field so it is not stored."""
+        start_date = "" if self.start_date is None else str(self.start_date)
+        return TRACKED_STOCK_V1_HEADER.pack(
+            TRACKED_STOCK_V1,
+            int(self.discord_channel),
+            float(self.book_cost),
+        ) + start_date.encode("utf-8")
+
+    @classmethod
+    def from_bytes(cls, ticker: str, raw: bytes) -> "TrackedStock":
+        """Decodes both the v1 encoding and the legacy JSON documents."""
+        if cls.is_legacy(raw):
+            return cls(**json.loads(raw))
+
+        version, discord_channel, book_cost = TRACKED_STOCK_V1_HEADER.unpack_from(raw)
+        if version != TRACKED_STOCK_V1:
+            raise ValueError(f"unknown TrackedStock encoding {version}")
+        start_date = raw[TRACKED_STOCK_V1_HEADER.size:].decode("utf-8")
+        return cls(
+            ticker=ticker,
+            discord_channel=discord_channel,
+            book_cost=book_cost,
+            start_date=start_date or None,
+        )
+
+    @staticmethod
+    def is_legacy(raw: bytes) -> bool:
+        return raw[:1] == b"{"
+
+
+@dataclass
+class PriceAlert:
+    ticker: str
+    kind: str  # one of ALERT_KINDS
+    # a price for above/below; for move, a signed percent change from book cost
+    threshold: float
+    discord_channel: int
+
+    def to_bytes(self) -> bytes:
+        """Ticker and kind are part of the hash field so they are not stored."""
+        return PRICE_ALERT_V1_FORMAT.pack(
+            PRICE_ALERT_V1, float(self.threshold), int(self.discord_channel))
+
+    @classmethod
+    def from_bytes(cls, ticker: str, kind: str, raw: bytes) -> "PriceAlert":
+        version, threshold, discord_channel = PRICE_ALERT_V1_FORMAT.unpack(raw)
+        if version != PRICE_ALERT_V1:
+            raise ValueError(f"unknown PriceAlert encoding {version}")
+        return cls(
+            ticker=ticker,
+            kind=kind,
+            threshold=threshold,
+            discord_channel=discord_channel,
+        )
+
+    def describe(self) -> str:
+        if self.kind == "move":
+            return f"`{self.ticker}` moves {self.threshold:+.2f}% from book cost"
+        return f"`{self.ticker}` goes {self.kind} `{self.threshold:.2f}`"
+
+
+@dataclass
+class UserSettings:
+    muted: bool = False
+    feedback_blacklisted: bool = False
+    default_channel: int = None
+
 
 @dataclass
 class DiscordUser:
     discord_id: int
     stocks: dict[str: TrackedStock]
+    settings: UserSettings = field(default_factory=UserSettings)
+    alerts: list[PriceAlert] = field(default_factory=list)
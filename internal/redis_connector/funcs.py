@@ -1,9 +1,170 @@
-import json
+from redis.asyncio import Redis
 
-from pandas import DataFrame
-from redis import Redis
+from ..funcs.metrics import metrics
+from .data_types import ALERT_KINDS, DiscordUser, PriceAlert, TrackedStock
 
-from .data_types import TrackedStock
+SETTINGS_PREFIX = "USER_SETTINGS."
+# alert fields are "ALERT.<ticker>.<kind>" in the user's hash
+ALERT_PREFIX = "ALERT."
+# max users read per pipeline round-trip
+PIPELINE_CHUNK_SIZE = 500
+
+# sets kept in step with the user hashes by add/drop_stock_from_user; the
+# holders of each ticker tell when it leaves the tickers index
+USERS_INDEX = "INDEX.USERS"
+TICKERS_INDEX = "INDEX.TICKERS"
+HOLDERS_INDEX_PREFIX = "INDEX.HOLDERS."
+# users blocked from sending feedback, kept in step by set_feedback_blacklisted
+FEEDBACK_BLACKLIST_INDEX = "INDEX.FEEDBACK_BLACKLIST"
+# users with at least one price alert
+ALERTS_INDEX = "INDEX.ALERTS"
+# incremented on every alert change so the alert engine knows to reload
+ALERTS_VERSION_KEY = "ALERTS.VERSION"
+# bumped when rebuild_indexes starts maintaining a new index
+INDEX_VERSION_KEY = "INDEX.VERSION"
+INDEX_VERSION = "3"
+
+# removes the ticker and its alerts from the user and prunes the indexes in
+# one atomic step
+DROP_STOCK_SCRIPT = """
+local removed = redis.call("HDEL", KEYS[1], ARGV[1])
+if removed == 0 then
+    return 0
+end
+local alerts_removed = 0
+for i = 4, #ARGV do
+    alerts_removed = alerts_removed + redis.call("HDEL", KEYS[1], ARGV[i])
+end
+if alerts_removed > 0 then
+    redis.call("INCR", KEYS[6])
+end
+redis.call("SREM", KEYS[2], KEYS[1])
+if redis.call("SCARD", KEYS[2]) == 0 then
+    redis.call("SREM", KEYS[3], ARGV[1])
+end
+local has_ticker, has_alert = false, false
+for _, field in ipairs(redis.call("HKEYS", KEYS[1])) do
+    if string.sub(field, 1, string.len(ARGV[3])) == ARGV[3] then
+        has_alert = true
+    elseif string.sub(field, 1, string.len(ARGV[2])) ~= ARGV[2] then
+        has_ticker = true
+    end
+end
+if not has_ticker then
+    redis.call("SREM", KEYS[4], KEYS[1])
+end
+if not has_alert then
+    redis.call("SREM", KEYS[5], KEYS[1])
+end
+return removed
+"""
+
+# drops users from the alerts index unless an alert was added since they were read
+PRUNE_ALERT_USERS_SCRIPT = """
+local pruned = 0
+for i = 2, #KEYS do
+    local has_alert = false
+    for _, field in ipairs(redis.call("HKEYS", KEYS[i])) do
+        if string.sub(field, 1, string.len(ARGV[1])) == ARGV[1] then
+            has_alert = true
+            break
+        end
+    end
+    if not has_alert then
+        pruned = pruned + redis.call("SREM", KEYS[1], KEYS[i])
+    end
+end
+return pruned
+"""
+
+# bumps the alerts version when the user has alerts, so the alert engine
+# reloads settings and book costs it has loaded
+BUMP_ALERTS_VERSION_SCRIPT = """
+if redis.call("SISMEMBER", KEYS[1], ARGV[1]) == 1 then
+    return redis.call("INCR", KEYS[2])
+end
+return 0
+"""
+
+# sets a user's index entries from their hash as it is now, so writes made
+# while rebuild_indexes runs are never overwritten. KEYS[6..] are the holders
+# sets of the tickers in ARGV[4..], read from the hash just before; any of
+# them dropped since is skipped
+REINDEX_USER_SCRIPT = """
+local user = KEYS[5]
+local has_ticker, has_alert, blacklisted = false, false, false
+local fields = redis.call("HGETALL", user)
+for j = 1, #fields, 2 do
+    local field, value = fields[j], fields[j + 1]
+    if string.sub(field, 1, string.len(ARGV[2])) == ARGV[2] then
+        has_alert = true
+    elseif field == ARGV[3] then
+        blacklisted = tonumber(value) == 1
+    elseif string.sub(field, 1, string.len(ARGV[1])) ~= ARGV[1] then
+        has_ticker = true
+    end
+end
+for i = 6, #KEYS do
+    local ticker = ARGV[i - 2]
+    if redis.call("HEXISTS", user, ticker) == 1 then
+        redis.call("SADD", KEYS[2], ticker)
+        redis.call("SADD", KEYS[i], user)
+    end
+end
+if has_ticker then
+    redis.call("SADD", KEYS[1], user)
+else
+    redis.call("SREM", KEYS[1], user)
+end
+if has_alert then
+    redis.call("SADD", KEYS[4], user)
+else
+    redis.call("SREM", KEYS[4], user)
+end
+if blacklisted then
+    redis.call("SADD", KEYS[3], user)
+else
+    redis.call("SREM", KEYS[3], user)
+end
+if has_ticker then
+    return 1
+end
+return 0
+"""
+
+# drops the holders in KEYS[3..] that no longer track the ticker, and the
+# ticker itself once nobody holds it
+PRUNE_HOLDERS_SCRIPT = """
+for i = 3, #KEYS do
+    if redis.call("HEXISTS", KEYS[i], ARGV[1]) == 0 then
+        redis.call("SREM", KEYS[2], KEYS[i])
+    end
+end
+if redis.call("SCARD", KEYS[2]) == 0 then
+    redis.call("SREM", KEYS[1], ARGV[1])
+end
+return 0
+"""
+
+
+def holders_key(ticker: str) -> str:
+    return HOLDERS_INDEX_PREFIX + ticker
+
+
+def queue_alerts_reload(pipe, discord_id: int | str):
+    """Queues an alerts version bump on `pipe` if the user has alerts."""
+    pipe.eval(BUMP_ALERTS_VERSION_SCRIPT, 2, ALERTS_INDEX, ALERTS_VERSION_KEY, discord_id)
+
+
+def alert_field(ticker: str, kind: str) -> str:
+    return f"{ALERT_PREFIX}{ticker}.{kind}"
+
+
+def is_ticker_field(field: bytes | str) -> bool:
+    """Whether a user hash field is a tracked stock rather than a setting or alert."""
+    if type(field) is bytes:
+        field = field.decode("utf-8")
+    return not field.startswith((SETTINGS_PREFIX, ALERT_PREFIX))
 
 
 async def add_stock_to_user(r: Redis, discord_id: int, tracked_stock: TrackedStock) -> int:
@@ -11,51 +172,272 @@ async def add_stock_to_user(r: Redis, discord_id: int, tracked_stock: TrackedSto
         discord_id = discord_id.__int__()
 
     tracked_stock.book_cost = round(tracked_stock.book_cost, 2)
-    resp = r.hset(
-        discord_id,
-        tracked_stock.ticker,
-        json.dumps(tracked_stock.to_dict(), indent=2,
-                   sort_keys=True, default=str).encode("utf-8")
-    )
+    pipe = r.pipeline(transaction=True)
+    pipe.hset(discord_id, tracked_stock.ticker, tracked_stock.to_bytes())
+    pipe.sadd(USERS_INDEX, discord_id)
+    pipe.sadd(TICKERS_INDEX, tracked_stock.ticker)
+    pipe.sadd(holders_key(tracked_stock.ticker), discord_id)
+    # a re-tracked stock may change the book cost a move alert compares against
+    queue_alerts_reload(pipe, discord_id)
+    resp = (await pipe.execute())[0]
     return resp
 
 
-async def get_stock_from_user(r: Redis, discord_id: int, stock_ticker: str) -> DataFrame:
+async def add_stocks_to_user(r: Redis, discord_id: int, tracked_stocks: list[TrackedStock]) -> list[int]:
+    """Writes many tracked stocks and their index entries in one transaction."""
     if type(discord_id) is not int:
         discord_id = discord_id.__int__()
 
-    price_data: bytes = r.hget(discord_id, str(stock_ticker))
-    return json.loads(price_data)
+    pipe = r.pipeline(transaction=True)
+    for tracked_stock in tracked_stocks:
+        tracked_stock.book_cost = round(tracked_stock.book_cost, 2)
+        pipe.hset(discord_id, tracked_stock.ticker, tracked_stock.to_bytes())
+        pipe.sadd(TICKERS_INDEX, tracked_stock.ticker)
+        pipe.sadd(holders_key(tracked_stock.ticker), discord_id)
+    if tracked_stocks:
+        pipe.sadd(USERS_INDEX, discord_id)
+        queue_alerts_reload(pipe, discord_id)
+    # each tracked stock queued three commands; keep the HSET results
+    return (await pipe.execute())[0:len(tracked_stocks) * 3:3]
 
 
 async def drop_stock_from_user(r: Redis, discord_id: int, stock_ticker: str) -> bool:
     if type(discord_id) is not int:
         discord_id = discord_id.__int__()
 
-    success = r.hdel(discord_id, stock_ticker)
+    success = await r.eval(
+        DROP_STOCK_SCRIPT,
+        6,
+        discord_id,
+        holders_key(stock_ticker),
+        TICKERS_INDEX,
+        USERS_INDEX,
+        ALERTS_INDEX,
+        ALERTS_VERSION_KEY,
+        stock_ticker,
+        SETTINGS_PREFIX,
+        ALERT_PREFIX,
+        *(alert_field(stock_ticker, kind) for kind in ALERT_KINDS),
+    )
     return success
 
 
 async def get_all_discord_ids(r: Redis) -> list[bytes]:
-    return list(r.scan_iter(_type="HASH"))
+    return sorted(await r.smembers(USERS_INDEX))
 
 
-async def get_all_tickers_from_user(r: Redis, discord_id: int) -> list[bytes]:
-    unfiltered = list(r.hgetall(discord_id))
-    return [i for i in unfiltered if "USER_SETTINGS." not in i.decode("utf=8")]
+async def get_all_tracked_tickers(r: Redis) -> list[str]:
+    return sorted(t.decode("utf-8") for t in await r.smembers(TICKERS_INDEX))
 
 
-async def is_user_muted(r: Redis, discord_id: int) -> bool:
-    resp = r.hget(discord_id, "USER_SETTINGS.MUTED")
-    if resp:
-        return int(resp) == 1
-    else:
-        return resp
+async def rebuild_indexes(r: Redis) -> int:
+    """Rebuilds the indexes from a scan of the user hashes.
+
+    Entries are added and pruned in place, each user atomically against the
+    hash as it is at that moment, so commands served during the rebuild
+    are kept. Returns the number of indexed users.
+    """
+    candidates: set[bytes] = set()
+    async for key in r.scan_iter(_type="HASH"):
+        if key.isdigit():  # a discord id
+            candidates.add(key)
+    # also revisit indexed users whose hash is gone or changed
+    for index in (USERS_INDEX, ALERTS_INDEX, FEEDBACK_BLACKLIST_INDEX):
+        candidates.update(await r.smembers(index))
+
+    discord_ids = sorted(candidates)
+    indexed = 0
+    for i in range(0, len(discord_ids), PIPELINE_CHUNK_SIZE):
+        chunk = discord_ids[i:i + PIPELINE_CHUNK_SIZE]
+        pipe = r.pipeline(transaction=False)
+        for discord_id in chunk:
+            pipe.hkeys(discord_id)
+        fields = await pipe.execute()
+
+        pipe = r.pipeline(transaction=False)
+        for discord_id, user_fields in zip(chunk, fields):
+            tickers = [f.decode("utf-8") for f in user_fields if is_ticker_field(f)]
+            pipe.eval(
+                REINDEX_USER_SCRIPT,
+                len(tickers) + 5,
+                USERS_INDEX,
+                TICKERS_INDEX,
+                FEEDBACK_BLACKLIST_INDEX,
+                ALERTS_INDEX,
+                discord_id,
+                *(holders_key(t) for t in tickers),
+                SETTINGS_PREFIX,
+                ALERT_PREFIX,
+                SETTINGS_PREFIX + "FEEDBACK_BLACKLISTED",
+                *tickers,
+            )
+        indexed += sum(await pipe.execute())
+
+    tickers = {t.decode("utf-8") for t in await r.smembers(TICKERS_INDEX)}
+    async for key in r.scan_iter(match=HOLDERS_INDEX_PREFIX + "*"):
+        tickers.add(key.decode("utf-8")[len(HOLDERS_INDEX_PREFIX):])
+    tickers = sorted(tickers)
+    for i in range(0, len(tickers), PIPELINE_CHUNK_SIZE):
+        chunk = tickers[i:i + PIPELINE_CHUNK_SIZE]
+        pipe = r.pipeline(transaction=False)
+        for ticker in chunk:
+            pipe.smembers(holders_key(ticker))
+        holders = await pipe.execute()
+
+        # holders added after the read are left alone, not pruned
+        pipe = r.pipeline(transaction=False)
+        for ticker, ticker_holders in zip(chunk, holders):
+            pipe.eval(
+                PRUNE_HOLDERS_SCRIPT,
+                len(ticker_holders) + 2,
+                TICKERS_INDEX,
+                holders_key(ticker),
+                *sorted(ticker_holders),
+                ticker,
+            )
+        await pipe.execute()
+
+    pipe = r.pipeline(transaction=True)
+    pipe.incr(ALERTS_VERSION_KEY)
+    pipe.set(INDEX_VERSION_KEY, INDEX_VERSION)
+    await pipe.execute()
+    return indexed
+
+
+async def indexes_outdated(r: Redis) -> bool:
+    """Whether the indexes predate the current INDEX_VERSION and need a rebuild."""
+    version = await r.get(INDEX_VERSION_KEY)
+    return version is None or version.decode("utf-8") != INDEX_VERSION
 
 
-async def is_user_fb_blacklisted(r: Redis, discord_id: int) -> bool:
-    resp = r.hget(discord_id, "USER_SETTINGS.FEEDBACK_BLACKLISTED")
-    if resp:
-        return int(resp) == 1
+async def set_feedback_blacklisted(r: Redis, discord_id: int | str, blacklisted: bool):
+    pipe = r.pipeline(transaction=True)
+    pipe.hset(discord_id, SETTINGS_PREFIX + "FEEDBACK_BLACKLISTED", int(blacklisted))
+    if blacklisted:
+        pipe.sadd(FEEDBACK_BLACKLIST_INDEX, discord_id)
     else:
-        return resp
+        pipe.srem(FEEDBACK_BLACKLIST_INDEX, discord_id)
+    await pipe.execute()
+
+
+async def set_muted(r: Redis, discord_id: int, muted: bool):
+    pipe = r.pipeline(transaction=True)
+    pipe.hset(discord_id, SETTINGS_PREFIX + "MUTED", int(muted))
+    queue_alerts_reload(pipe, discord_id)
+    await pipe.execute()
+
+
+async def set_default_channel(r: Redis, discord_id: int, channel_id: int):
+    pipe = r.pipeline(transaction=True)
+    pipe.hset(discord_id, SETTINGS_PREFIX + "DEFAULT_CHANNEL", channel_id)
+    queue_alerts_reload(pipe, discord_id)
+    await pipe.execute()
+
+
+async def get_feedback_blacklist(r: Redis) -> set[int]:
+    return {int(id) for id in await r.smembers(FEEDBACK_BLACKLIST_INDEX)}
+
+
+def parse_user_hash(discord_id: bytes | int, raw: dict[bytes, bytes]) -> DiscordUser:
+    """Builds a DiscordUser from the raw HGETALL of a user's hash."""
+    user = DiscordUser(discord_id=int(discord_id), stocks={})
+    for key, value in raw.items():
+        key = key.decode("utf-8")
+        if key == SETTINGS_PREFIX + "MUTED":
+            user.settings.muted = int(value) == 1
+        elif key == SETTINGS_PREFIX + "FEEDBACK_BLACKLISTED":
+            user.settings.feedback_blacklisted = int(value) == 1
+        elif key == SETTINGS_PREFIX + "DEFAULT_CHANNEL":
+            user.settings.default_channel = int(value)
+        elif key.startswith(ALERT_PREFIX):
+            ticker, kind = key[len(ALERT_PREFIX):].rsplit(".", 1)
+            user.alerts.append(PriceAlert.from_bytes(ticker, kind, value))
+        elif not key.startswith(SETTINGS_PREFIX):
+            user.stocks[key] = TrackedStock.from_bytes(key, value)
+    return user
+
+
+async def get_user(r: Redis, discord_id: bytes | int) -> DiscordUser:
+    with metrics.span("redis_read"):
+        raw = await r.hgetall(discord_id)
+    return parse_user_hash(discord_id, raw)
+
+
+async def get_users(r: Redis, discord_ids: list[bytes | int]) -> list[DiscordUser]:
+    """Reads many users' hashes in pipelined HGETALL batches."""
+    users = []
+    for i in range(0, len(discord_ids), PIPELINE_CHUNK_SIZE):
+        chunk = discord_ids[i:i + PIPELINE_CHUNK_SIZE]
+        pipe = r.pipeline(transaction=False)
+        for discord_id in chunk:
+            pipe.hgetall(discord_id)
+        with metrics.span("redis_read"):
+            raws = await pipe.execute()
+        users.extend(
+            parse_user_hash(discord_id, raw)
+            for discord_id, raw in zip(chunk, raws)
+        )
+    return users
+
+
+async def migrate_tracked_stocks(r: Redis) -> int:
+    """Re-encodes every legacy JSON TrackedStock in the compact format.
+
+    Returns the number of records converted.
+    """
+    discord_ids = await get_all_discord_ids(r=r)
+    converted = 0
+    for i in range(0, len(discord_ids), PIPELINE_CHUNK_SIZE):
+        chunk = discord_ids[i:i + PIPELINE_CHUNK_SIZE]
+        pipe = r.pipeline(transaction=False)
+        for discord_id in chunk:
+            pipe.hgetall(discord_id)
+        raws = await pipe.execute()
+
+        pipe = r.pipeline(transaction=False)
+        for discord_id, raw in zip(chunk, raws):
+            for key, value in raw.items():
+                key = key.decode("utf-8")
+                if not is_ticker_field(key) or not TrackedStock.is_legacy(value):
+                    continue
+                pipe.hset(discord_id, key, TrackedStock.from_bytes(key, value).to_bytes())
+                converted += 1
+        await pipe.execute()
+    return converted
+
+
+async def set_alert(r: Redis, discord_id: int, alert: PriceAlert) -> int:
+    """Adds or replaces the user's alert of this kind on the ticker."""
+    pipe = r.pipeline(transaction=True)
+    pipe.hset(discord_id, alert_field(alert.ticker, alert.kind), alert.to_bytes())
+    pipe.sadd(ALERTS_INDEX, discord_id)
+    pipe.incr(ALERTS_VERSION_KEY)
+    return (await pipe.execute())[0]
+
+
+async def remove_alert(r: Redis, discord_id: int, ticker: str, kind: str) -> bool:
+    # the user stays in ALERTS_INDEX until the alert engine prunes it
+    pipe = r.pipeline(transaction=True)
+    pipe.hdel(discord_id, alert_field(ticker, kind))
+    pipe.incr(ALERTS_VERSION_KEY)
+    return (await pipe.execute())[0] == 1
+
+
+async def get_alert_users(r: Redis) -> list[bytes]:
+    return sorted(await r.smembers(ALERTS_INDEX))
+
+
+async def get_alerts_version(r: Redis) -> int:
+    return int(await r.get(ALERTS_VERSION_KEY) or 0)
+
+
+async def prune_alert_users(r: Redis, discord_ids: list[bytes]) -> int:
+    if not discord_ids:
+        return 0
+    return await r.eval(
+        PRUNE_ALERT_USERS_SCRIPT,
+        len(discord_ids) + 1,
+        ALERTS_INDEX,
+        *discord_ids,
+        ALERT_PREFIX,
+    )
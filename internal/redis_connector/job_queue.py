@@ -0,0 +1,210 @@
+import asyncio
+import json
+import os
+from typing import Awaitable, Callable
+
+from redis.asyncio import Redis
+from redis.exceptions import RedisError, ResponseError
+
+from ..funcs.metrics import metrics
+from ..funcs.printflush import printFlush
+
+JOBS_STREAM = "JOBS.STREAM"
+# jobs that failed every attempt, kept for inspection
+DEAD_JOBS_STREAM = "JOBS.DEAD"
+JOBS_GROUP = "workers"
+# approximate number of entries kept in each stream
+JOBS_MAX_LEN = 10000
+
+JobHandler = Callable[..., Awaitable]
+
+
+class JobQueue:
+    """Jobs on a Redis stream, consumed by worker processes in one group.
+
+    A job is acknowledged only once its handler returns. A failed job, or one
+    left behind by a worker that died, stays pending and is claimed again by
+    any worker after `retry_after` seconds, up to `max_attempts` deliveries
+    before it moves to the dead letter stream.
+
+    Each worker runs up to `concurrency` jobs at once and takes the next job
+    as soon as one finishes, so a long weekly run doesn't hold up updates.
+    """
+
+    def __init__(
+        self,
+        r: Redis,
+        concurrency: int = None,
+        max_attempts: int = None,
+        retry_after: float = None,
+        timeout: float = None,
+        block: float = None,
+    ):
+        self.r = r
+        self.concurrency = concurrency or int(os.getenv("JOB_CONCURRENCY", 4))
+        self.max_attempts = max_attempts or int(os.getenv("JOB_MAX_ATTEMPTS", 3))
+        self.retry_after = retry_after or float(os.getenv("JOB_RETRY_AFTER_SECONDS", 60))
+        self.timeout = timeout or float(os.getenv("JOB_TIMEOUT_SECONDS", 1800))
+        self.block = block or float(os.getenv("JOB_BLOCK_SECONDS", 2))
+        # the socket timeout also covers blocking reads, so an idle XREADGROUP
+        # has to return before it fires
+        socket_timeout = r.connection_pool.connection_kwargs.get("socket_timeout")
+        if socket_timeout:
+            self.block = min(self.block, socket_timeout / 2)
+        self._running: set[bytes] = set()
+
+    async def enqueue(self, kind: str, **payload) -> str:
+        """Adds a job for `kind`'s handler, called with `payload` as keyword arguments."""
+        job_id = await self.r.xadd(
+            JOBS_STREAM,
+            {"kind": kind, "payload": json.dumps(payload)},
+            maxlen=JOBS_MAX_LEN,
+            approximate=True,
+        )
+        metrics.inc("jobs_enqueued", kind=kind)
+        return job_id.decode("utf-8")
+
+    async def ensure_group(self):
+        try:
+            await self.r.xgroup_create(JOBS_STREAM, JOBS_GROUP, id="0", mkstream=True)
+        except ResponseError as e:
+            if "BUSYGROUP" not in str(e):
+                raise
+
+    async def work(self, consumer: str, handlers: dict[str, JobHandler]):
+        """Runs jobs as `consumer` until cancelled, up to `concurrency` at a time."""
+        await self.ensure_group()
+        printFlush(f"{consumer} consuming {JOBS_STREAM} for {sorted(handlers)}")
+        running: set[asyncio.Task] = set()
+        failures = 0
+        while True:
+            if len(running) >= self.concurrency:
+                await asyncio.wait(running, return_when=asyncio.FIRST_COMPLETED)
+                continue
+
+            free = self.concurrency - len(running)
+            try:
+                jobs = await self._claim_stale(consumer, free)
+                if len(jobs) < free:
+                    jobs += await self._read_new(consumer, free - len(jobs))
+            except RedisError as e:
+                # running jobs carry on; reading resumes once Redis is back
+                delay = min(2 ** failures, 30)
+                failures += 1
+                printFlush(
+                    f"could not read jobs ({e!r}), retrying in {delay}s",
+                    event="job_read_failed", consumer=consumer, delay=delay, error=repr(e))
+                await asyncio.sleep(delay)
+                continue
+            failures = 0
+
+            for job in jobs:
+                task = asyncio.create_task(self._process(consumer, handlers, *job))
+                running.add(task)
+                task.add_done_callback(running.discard)
+
+    async def _read_new(self, consumer: str, count: int) -> list[tuple[bytes, dict, int]]:
+        response = await self.r.xreadgroup(
+            JOBS_GROUP, consumer, {JOBS_STREAM: ">"}, count=count, block=int(self.block * 1000))
+        if not response:
+            return []
+        return [(job_id, fields, 1) for job_id, fields in response[0][1]]
+
+    async def _claim_stale(self, consumer: str, count: int) -> list[tuple[bytes, dict, int]]:
+        """Takes over jobs pending longer than `retry_after`, with their delivery counts."""
+        _, claimed, *_ = await self.r.xautoclaim(
+            JOBS_STREAM,
+            JOBS_GROUP,
+            consumer,
+            min_idle_time=int(self.retry_after * 1000),
+            count=count,
+        )
+        jobs = []
+        for job_id, fields in claimed:
+            # a job of ours can go idle if the loop stalls past its heartbeat
+            if job_id is None or job_id in self._running:
+                continue
+            if fields is None:  # trimmed from the stream while pending
+                await self.r.xack(JOBS_STREAM, JOBS_GROUP, job_id)
+                continue
+            pending = await self.r.xpending_range(
+                JOBS_STREAM, JOBS_GROUP, min=job_id, max=job_id, count=1)
+            jobs.append((job_id, fields, pending[0]["times_delivered"] if pending else 1))
+        return jobs
+
+    async def _process(
+        self,
+        consumer: str,
+        handlers: dict[str, JobHandler],
+        job_id: bytes,
+        fields: dict,
+        deliveries: int,
+    ):
+        kind = fields[b"kind"].decode("utf-8")
+        name = job_id.decode("utf-8")
+        handler = handlers.get(kind)
+        if handler is None or deliveries > self.max_attempts:
+            reason = "no handler" if handler is None else f"failed {deliveries - 1} attempts"
+            try:
+                await self._dead_letter(job_id, fields, reason)
+            except RedisError as e:
+                printFlush(f"could not dead letter job {name}: {e!r}", job_id=name)
+            return
+
+        self._running.add(job_id)
+        heartbeat = asyncio.create_task(self._heartbeat(consumer, job_id))
+        try:
+            with metrics.span("job", kind=kind):
+                await asyncio.wait_for(
+                    handler(**json.loads(fields[b"payload"])), self.timeout)
+        except Exception as e:
+            # left pending, so a worker picks it up again after retry_after
+            metrics.inc("job_failures", kind=kind)
+            printFlush(
+                f"job {name} ({kind}) failed on attempt {deliveries}: {e!r}",
+                event="job_failed",
+                job_id=name,
+                kind=kind,
+                attempt=deliveries,
+                error=repr(e),
+            )
+            return
+        finally:
+            heartbeat.cancel()
+            self._running.discard(job_id)
+        metrics.inc("jobs_done", kind=kind)
+        try:
+            await self.r.xack(JOBS_STREAM, JOBS_GROUP, job_id)
+        except RedisError as e:
+            # the job stays pending and runs again after retry_after
+            printFlush(f"could not ack job {name}: {e!r}", job_id=name, kind=kind)
+
+    async def _heartbeat(self, consumer: str, job_id: bytes):
+        """Resets the job's idle time while it runs, so long jobs aren't claimed twice."""
+        while True:
+            await asyncio.sleep(self.retry_after / 3)
+            try:
+                await self.r.xclaim(
+                    JOBS_STREAM, JOBS_GROUP, consumer,
+                    min_idle_time=0, message_ids=[job_id], justid=True)
+            except RedisError as e:
+                printFlush(f"could not extend job {job_id.decode('utf-8')}: {e!r}", job_id=job_id.decode("utf-8"))
+
+    async def _dead_letter(self, job_id: bytes, fields: dict, reason: str):
+        pipe = self.r.pipeline()
+        pipe.xadd(
+            DEAD_JOBS_STREAM,
+            {**fields, "job_id": job_id, "reason": reason},
+            maxlen=JOBS_MAX_LEN,
+            approximate=True,
+        )
+        pipe.xack(JOBS_STREAM, JOBS_GROUP, job_id)
+        await pipe.execute()
+        metrics.inc("jobs_dead", kind=fields[b"kind"].decode("utf-8"))
+        printFlush(
+            f"moved job {job_id.decode('utf-8')} to {DEAD_JOBS_STREAM}: {reason}",
+            event="job_dead",
+            job_id=job_id.decode("utf-8"),
+            kind=fields[b"kind"].decode("utf-8"),
+            reason=reason,
+        )
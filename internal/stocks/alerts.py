@@ -0,0 +1,178 @@
+import asyncio
+import os
+from collections import defaultdict
+
+import interactions
+import numpy as np
+from redis.asyncio import Redis
+
+from ..funcs.metrics import metrics
+from ..funcs.printflush import printFlush
+from ..redis_connector import funcs as rds
+from ..redis_connector.data_types import ALERT_KINDS, DiscordUser, PriceAlert
+from .channel_cache import get_channel_cache
+from .market_hours import is_market_open, next_market_open, now_eastern
+from .notification_scheduler import DiscordRateLimits
+from .stock_functions import download_latest_closes
+
+# "<discord id>:<alert field>" for alerts whose condition currently holds;
+# an alert fires when it joins the set and re-arms when it leaves
+TRIGGERED_KEY = "ALERTS.TRIGGERED"
+ABOVE, BELOW, MOVE = (ALERT_KINDS.index(kind) for kind in ("above", "below", "move"))
+
+
+class AlertBook:
+    """Every alert as flat arrays indexed by alert, with tickers mapped to
+    positions in `tickers`, so a poll evaluates them all in one pass."""
+
+    def __init__(self, users: list[DiscordUser]):
+        self.alerts: list[PriceAlert] = []
+        self.discord_ids: list[int] = []
+        self.channels: list[int] = []
+        self.muted: list[bool] = []
+        book_costs = []
+        for user in users:
+            for alert in user.alerts:
+                stock = user.stocks.get(alert.ticker)
+                self.alerts.append(alert)
+                self.discord_ids.append(user.discord_id)
+                self.channels.append(user.settings.default_channel or alert.discord_channel)
+                self.muted.append(user.settings.muted)
+                book_costs.append(stock.book_cost if stock else np.nan)
+
+        self.tickers = sorted({alert.ticker for alert in self.alerts})
+        positions = {ticker: i for i, ticker in enumerate(self.tickers)}
+        self.ticker_index = np.array([positions[a.ticker] for a in self.alerts], dtype=np.intp)
+        self.kind = np.array([ALERT_KINDS.index(a.kind) for a in self.alerts], dtype=np.int8)
+        self.threshold = np.array([a.threshold for a in self.alerts], dtype=np.float64)
+        self.book_cost = np.array(book_costs, dtype=np.float64)
+        self.triggered = np.zeros(len(self.alerts), dtype=bool)
+        self.keys = [
+            f"{id}:{rds.alert_field(a.ticker, a.kind)}"
+            for id, a in zip(self.discord_ids, self.alerts)
+        ]
+
+    def __len__(self) -> int:
+        return len(self.alerts)
+
+    def evaluate(self, prices: np.ndarray) -> tuple[np.ndarray, np.ndarray, np.ndarray]:
+        """Takes the latest price per ticker, aligned with `tickers`.
+
+        Returns each alert's price, the alerts that just fired and the
+        alerts that re-armed. Alerts without a price are left as they are.
+        """
+        price = prices[self.ticker_index]
+        # comparisons against NaN prices or book costs are simply False
+        with np.errstate(divide="ignore", invalid="ignore"):
+            move = (price - self.book_cost) / self.book_cost * 100
+            hit = np.select(
+                [self.kind == ABOVE, self.kind == BELOW],
+                [price >= self.threshold, price <= self.threshold],
+                default=np.where(self.threshold >= 0, move >= self.threshold, move <= self.threshold),
+            )
+        known = ~np.isnan(price)
+        fired = np.flatnonzero(hit & ~self.triggered & known)
+        rearmed = np.flatnonzero(~hit & self.triggered & known)
+        self.triggered[fired] = True
+        self.triggered[rearmed] = False
+        return price, fired, rearmed
+
+
+class AlertEngine:
+    """Polls the union of alerted tickers while the market is open and
+    notifies users whose alerts fire. Alerts reload only when they change."""
+
+    def __init__(self, bot: interactions.Client, r: Redis, interval: float = None):
+        self.bot = bot
+        self.r = r
+        self.interval = interval or float(os.getenv("ALERT_POLL_SECONDS", 60))
+        self.book = AlertBook([])
+        self.version: int = None
+        self.rate_limits = DiscordRateLimits()
+
+    async def reload(self):
+        version = await rds.get_alerts_version(r=self.r)
+        if version == self.version:
+            return
+        discord_ids = await rds.get_alert_users(r=self.r)
+        users = await rds.get_users(r=self.r, discord_ids=discord_ids)
+        await rds.prune_alert_users(
+            r=self.r,
+            discord_ids=[id for id, user in zip(discord_ids, users) if not user.alerts],
+        )
+        book = AlertBook([user for user in users if user.alerts])
+
+        triggered = {key.decode("utf-8") for key in await self.r.smembers(TRIGGERED_KEY)}
+        book.triggered[:] = [key in triggered for key in book.keys]
+        stale = triggered.difference(book.keys)
+        if stale:
+            await self.r.srem(TRIGGERED_KEY, *stale)
+
+        self.book, self.version = book, version
+        printFlush(f"loaded {len(book)} alerts on {len(book.tickers)} tickers")
+
+    async def poll(self):
+        await self.reload()
+        book = self.book
+        if not book.tickers:
+            return
+
+        latest = await download_latest_closes(book.tickers)
+        prices = np.array([latest.get(t, np.nan) for t in book.tickers], dtype=np.float64)
+        with metrics.span("alert_evaluate"):
+            price, fired, rearmed = book.evaluate(prices)
+        if not len(fired) and not len(rearmed):
+            return
+
+        # SADD only succeeds for one process, so each crossing is sent once
+        pipe = self.r.pipeline(transaction=False)
+        for i in fired:
+            pipe.sadd(TRIGGERED_KEY, book.keys[i])
+        if len(rearmed):
+            pipe.srem(TRIGGERED_KEY, *(book.keys[i] for i in rearmed))
+        added = (await pipe.execute())[:len(fired)]
+
+        by_user: dict[tuple[int, int], list[int]] = defaultdict(list)
+        for i, new in zip(fired, added):
+            if new:
+                by_user[(book.discord_ids[i], book.channels[i])].append(i)
+        metrics.inc("alerts_fired", sum(len(rows) for rows in by_user.values()))
+
+        results = await asyncio.gather(
+            *(self.notify(id, channel_id, rows, price) for (id, channel_id), rows in by_user.items()),
+            return_exceptions=True,
+        )
+        for (id, _), result in zip(by_user, results):
+            if isinstance(result, Exception):
+                printFlush(
+                    f"could not send alerts to {id}: {result!r}",
+                    event="alert_failed", discord_id=id, error=repr(result))
+
+    async def notify(self, discord_id: int, channel_id: int, rows: list[int], price: np.ndarray):
+        book = self.book
+        lines = [
+            f"- {book.alerts[i].describe()}: now `{price[i]:.2f}`"
+            for i in rows
+        ]
+        mention = f"<@{discord_id}> " if not book.muted[rows[0]] else ""
+        channels = get_channel_cache()
+        channel = await channels.get(self.bot, channel_id, rate_limits=self.rate_limits)
+        await self.rate_limits.acquire(channel_id)
+        try:
+            with metrics.span("discord_send"):
+                await channel.send(f"{mention}Price alert:\n" + "\n".join(lines))
+        except Exception:
+            channels.invalidate(channel_id)
+            raise
+
+    async def run(self):
+        while True:
+            now = now_eastern()
+            if not is_market_open(now):
+                await asyncio.sleep((next_market_open(now) - now).total_seconds())
+                continue
+            try:
+                await self.poll()
+            except Exception as e:
+                printFlush(f"alert poll failed: {e!r}")
+            await asyncio.sleep(self.interval)
@@ -0,0 +1,71 @@
+import asyncio
+import os
+from collections import OrderedDict
+
+import interactions
+
+from ..funcs.metrics import metrics
+from .notification_scheduler import DiscordRateLimits
+
+
+class ChannelCache:
+    """Channel and DM objects by id, so repeat deliveries skip the fetch.
+    Entries are dropped when the channel is deleted or a send to it fails."""
+
+    def __init__(self, max_size: int = 4096):
+        self.max_size = max_size
+        self.fetches = 0
+        self._channels: OrderedDict[int, interactions.Channel] = OrderedDict()
+        self._fetching: dict[int, asyncio.Future] = {}
+
+    async def get(
+        self,
+        bot: interactions.Client,
+        channel_id: int | str,
+        rate_limits: DiscordRateLimits = None,
+    ) -> interactions.Channel:
+        channel_id = int(channel_id)
+        channel = self._channels.get(channel_id)
+        if channel is not None:
+            self._channels.move_to_end(channel_id)
+            metrics.inc("cache_hits", cache="channel", tier="memory")
+            return channel
+
+        metrics.inc("cache_misses", cache="channel")
+        # concurrent deliveries to one channel share a single fetch
+        fetch = self._fetching.get(channel_id)
+        if fetch is None:
+            fetch = asyncio.ensure_future(self._fetch(bot, channel_id, rate_limits))
+            self._fetching[channel_id] = fetch
+            fetch.add_done_callback(lambda _: self._fetching.pop(channel_id, None))
+        return await asyncio.shield(fetch)
+
+    async def _fetch(
+        self,
+        bot: interactions.Client,
+        channel_id: int,
+        rate_limits: DiscordRateLimits = None,
+    ) -> interactions.Channel:
+        if rate_limits:
+            await rate_limits.acquire()
+        self.fetches += 1
+        channel = await interactions.get(bot, interactions.Channel, object_id=channel_id)
+        self._channels[channel_id] = channel
+        while len(self._channels) > self.max_size:
+            self._channels.popitem(last=False)
+        return channel
+
+    def invalidate(self, channel_id: int | str):
+        self._channels.pop(int(channel_id), None)
+
+
+_channel_cache: ChannelCache = None
+
+
+def get_channel_cache() -> ChannelCache:
+    """Shared cache sized by CHANNEL_CACHE_SIZE."""
+    global _channel_cache
+    if _channel_cache is None:
+        _channel_cache = ChannelCache(
+            max_size=int(os.getenv("CHANNEL_CACHE_SIZE", 4096)))
+    return _channel_cache
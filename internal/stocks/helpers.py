@@ -1,11 +1,25 @@
+import asyncio
+import functools
+import hashlib
 import io
+import os
 from typing import List
 
 import numpy as np
 import pandas as pd
-import plotly.graph_objects as go
 from prettytable import ALL, NONE, SINGLE_BORDER, PrettyTable
 
+from .price_cache import PriceCache
+from .render_pool import get_render_pool
+
+# table color and formatting shared by both renderers
+HEADER_COLOR = "darkslategrey"
+LINE_COLOR = "white"
+ROW_ODD_COLOR = "white"
+ROW_EVEN_COLOR = "#e4f8ff"
+PIL_TABLE_WIDTH = 700
+PCT_COLUMNS = ("ROI Inception", "% Δ Weekly")
+
 
 async def get_change_icon(change: float) -> str:
     if change > 0:
@@ -28,49 +42,98 @@ async def pretty_table_defaults(headers=None) -> PrettyTable:
     return template
 
 
-async def create_update_table(buff: io.BytesIO, df: pd.DataFrame):
+# rendered PNGs keyed by table content, so identical tables skip rendering
+_image_cache = PriceCache(
+    max_size=int(os.getenv("IMAGE_CACHE_SIZE", 256)), name="image")
+_rendering: dict[str, asyncio.Future] = {}
 
-    starting_cols = df.columns
+
+def table_hash(df: pd.DataFrame, renderer: str) -> str:
+    digest = hashlib.sha256(renderer.encode("utf-8"))
+    digest.update("|".join(df.columns).encode("utf-8"))
+    digest.update(pd.util.hash_pandas_object(df, index=False).values.tobytes())
+    return digest.hexdigest()
+
+
+async def create_update_table(buff: io.BytesIO, df: pd.DataFrame):
+    renderer = os.getenv("TABLE_RENDERER", "plotly")
+    key = table_hash(df, renderer)
+
+    png = await _image_cache.get(key)
+    if png is None:
+        # share one render between concurrent requests for the same table
+        render = _rendering.get(key)
+        if render is None:
+            render = asyncio.ensure_future(
+                get_render_pool().render(RENDERERS[renderer], df))
+            _rendering[key] = render
+            render.add_done_callback(lambda _: _rendering.pop(key, None))
+        png = await render
+        await _image_cache.set(key, png, ttl=float(os.getenv("IMAGE_CACHE_TTL", 60)))
+    buff.write(png)
+
+
+def format_update_table(df: pd.DataFrame) -> pd.DataFrame:
+    """Formats the numeric update table as display strings."""
+    formatted = df.copy()
+    for col in df.columns:
+        if col in PCT_COLUMNS:
+            formatted[col] = df[col].map("{:.2f}%".format)
+        elif pd.api.types.is_float_dtype(df[col]):
+            formatted[col] = df[col].map("{:.2f}".format)
+    return formatted
+
+
+def table_text_colors(df: pd.DataFrame) -> List[List[str]]:
+    """Per-column font colors: deltas are red/green/grey, everything else black."""
     colors = ["red", "green", "lightgrey"]
 
     # get numeric cols to compare
-    incept_change_values: pd.Series = df["$ Δ Inception"].astype("float16")
-    weekly_change_values: pd.Series = df["$ Δ Weekly"].astype("float16")
+    incept_change_values: pd.Series = df["$ Δ Inception"]
+    weekly_change_values: pd.Series = df["$ Δ Weekly"]
 
     # create conditions
-    incept_color_conds = await create_font_color_conditions(incept_change_values)
-    weekly_color_conds = await create_font_color_conditions(weekly_change_values)
+    incept_color_conds = create_font_color_conditions(incept_change_values)
+    weekly_color_conds = create_font_color_conditions(weekly_change_values)
 
-    # add cols to dataframe used be used for color formatting
-    df["incept_color"] = np.select(incept_color_conds, colors, None)
-    df["weekly_color"] = np.select(weekly_color_conds, colors, None)
+    incept_color = np.select(incept_color_conds, colors, None).tolist()
+    weekly_color = np.select(weekly_color_conds, colors, None).tolist()
 
     text_color = []
     # apply color formatting to the following cols: "$ Δ Inception", "$ Δ Weekly", "% Δ Weekly", "ROI Inception"
-    for col in starting_cols:
+    for col in df.columns:
         if col not in ("$ Δ Inception", "$ Δ Weekly", "% Δ Weekly", "ROI Inception"):
             text_color.append(["black"] * df.shape[0])
         elif col == "$ Δ Inception" or col == "ROI Inception":
-            text_color.append(df["incept_color"].to_list())
+            text_color.append(incept_color)
         elif col == "$ Δ Weekly" or col == "% Δ Weekly":
-            text_color.append(df["weekly_color"].to_list())
+            text_color.append(weekly_color)
+    return text_color
+
+
+def render_update_table(df: pd.DataFrame) -> bytes:
+    """Renders the update table to PNG bytes with Plotly and Kaleido.
+    Runs inside a render pool worker."""
+    import plotly.graph_objects as go
+
+    starting_cols = df.columns
+    text_color = table_text_colors(df)
+    formatted = format_update_table(df)
 
     # table color and formatting
-    row_odd_color = "white"
-    row_even_color = "#e4f8ff"
     fig_height = 60 + df.shape[0] * 20
 
     fig = go.Figure(
         data=[go.Table(
             header=dict(values=starting_cols,
-                        line_color='white',
-                        fill_color="darkslategrey",
+                        line_color=LINE_COLOR,
+                        fill_color=HEADER_COLOR,
                         align="center",
                         font_color="white",
                         ),
-            cells=dict(values=df[starting_cols].values.T,
-                       line_color='white',
-                       fill_color=[[row_odd_color, row_even_color]
+            cells=dict(values=formatted[starting_cols].values.T,
+                       line_color=LINE_COLOR,
+                       fill_color=[[ROW_ODD_COLOR, ROW_EVEN_COLOR]
                                    * df.shape[0]],
                        align='right',
                        font=dict(color=text_color)
@@ -78,10 +141,92 @@ async def create_update_table(buff: io.BytesIO, df: pd.DataFrame):
         )
         ])
     fig.update_layout(margin=dict(r=5, l=5, t=5, b=5), height=fig_height+5)
-    fig.write_image(file=buff, format="png")
+    return fig.to_image(format="png")
+
+
+def render_update_table_pil(df: pd.DataFrame) -> bytes:
+    """Renders the same table as `render_update_table` with Pillow, without a
+    headless browser. Runs inside a render pool worker."""
+    from PIL import Image, ImageDraw
+
+    font = _table_font()
+    text_color = table_text_colors(df)
+    cols = list(df.columns)
+    values = format_update_table(df)[cols].values.T
+    margin, header_height, row_height, padding = 5, 28, 20, 6
+    col_width = (PIL_TABLE_WIDTH - 2 * margin) // len(cols)
+    height = 2 * margin + header_height + df.shape[0] * row_height
+
+    image = Image.new("RGB", (PIL_TABLE_WIDTH, height), "white")
+    draw = ImageDraw.Draw(image)
+
+    for i, col in enumerate(cols):
+        left = margin + i * col_width
+        right = left + col_width
+        draw.rectangle(
+            (left, margin, right, margin + header_height),
+            fill=HEADER_COLOR,
+            outline=LINE_COLOR,
+        )
+        _draw_cell_text(draw, font, str(col), "white",
+                        (left, margin, right, margin + header_height), "center")
+
+        for row in range(df.shape[0]):
+            top = margin + header_height + row * row_height
+            draw.rectangle(
+                (left, top, right, top + row_height),
+                fill=ROW_ODD_COLOR if row % 2 == 0 else ROW_EVEN_COLOR,
+                outline=LINE_COLOR,
+            )
+            _draw_cell_text(draw, font, str(values[i][row]), text_color[i][row],
+                            (left, top, right - padding, top + row_height), "right")
+
+    with io.BytesIO() as buffer:
+        image.save(buffer, format="PNG", optimize=False)
+        return buffer.getvalue()
+
+
+@functools.lru_cache(maxsize=None)
+def _table_font():
+    """TABLE_FONT if set, else DejaVu Sans from the system or the copy bundled
+    with matplotlib, else Pillow's latin-1 bitmap font."""
+    from PIL import ImageFont
+
+    paths = [os.getenv("TABLE_FONT"), "DejaVuSans.ttf"]
+    try:
+        import matplotlib
+        paths.append(os.path.join(matplotlib.get_data_path(), "fonts", "ttf", "DejaVuSans.ttf"))
+    except ImportError:
+        pass
+    for path in filter(None, paths):
+        try:
+            return ImageFont.truetype(path, 12)
+        except OSError:
+            continue
+    return ImageFont.load_default()
+
+
+def _draw_cell_text(draw, font, text: str, color: str, box: tuple, align: str):
+    # bitmap fallback fonts don't support anchors, so position from the bbox
+    if not hasattr(font, "path"):  # the bitmap font only encodes latin-1
+        text = text.replace("Δ", "Chg").encode("latin-1", "replace").decode("latin-1")
+    left, top, right, bottom = box
+    x0, y0, x1, y1 = font.getbbox(text)
+    y = (top + bottom - (y1 - y0)) / 2 - y0
+    if align == "center":
+        x = (left + right - (x1 - x0)) / 2 - x0
+    else:
+        x = right - x1
+    draw.text((x, y), text, fill=color, font=font)
+
+
+RENDERERS = {
+    "plotly": render_update_table,
+    "pil": render_update_table_pil,
+}
 
 
-async def create_font_color_conditions(series: pd.Series) -> List[bool]:
+def create_font_color_conditions(series: pd.Series) -> List[bool]:
     return [
         (series < 0),
         (series > 0),
@@ -0,0 +1,99 @@
+import os
+
+import interactions
+from redis.asyncio import Redis
+
+from ..funcs.printflush import printFlush
+from ..redis_connector.job_queue import JobHandler, JobQueue
+from .channel_cache import get_channel_cache
+from .notifications import (send_weekly_notifications, stock_update_user,
+                            warm_up_weekly_notifications)
+from .portfolio_import import import_text, track_position
+from .stock_functions import get_weekly_closes
+
+UPDATE_USER = "update_user"
+TRACK = "track"
+TRACK_MANY = "track_many"
+WEEKLY_WARM_UP = "weekly_warm_up"
+WEEKLY_SEND = "weekly_send"
+
+
+def weekly_shards() -> int:
+    """Jobs a weekly run is split into, so several workers can share it."""
+    return max(int(os.getenv("WEEKLY_JOB_SHARDS", 1)), 1)
+
+
+async def enqueue_weekly_warm_up(queue: JobQueue, run_id: str):
+    shards = weekly_shards()
+    for index in range(shards):
+        await queue.enqueue(WEEKLY_WARM_UP, run_id=run_id, shard_index=index, shard_count=shards)
+
+
+async def enqueue_weekly_send(queue: JobQueue, run_id: str):
+    shards = weekly_shards()
+    for index in range(shards):
+        await queue.enqueue(WEEKLY_SEND, run_id=run_id, shard_index=index, shard_count=shards)
+
+
+def job_handlers(bot: interactions.Client, r: Redis) -> dict[str, JobHandler]:
+    """Handlers for the jobs the gateway enqueues, keyed by job kind."""
+
+    async def update_user(discord_id: str, channel_id: int = None, message_id: int = None):
+        msg = None
+        if message_id is not None:  # /update_me; edit the placeholder reply
+            channel = await get_channel_cache().get(bot, channel_id)
+            msg = await channel.get_message(message_id)
+        await stock_update_user(bot=bot, r=r, id=discord_id.encode("utf-8"), msg=msg)
+
+    async def reply(channel_id: int, message_id: int, contents: list[str]):
+        # edits the command's placeholder, with any overflow as follow-ups
+        channel = await get_channel_cache().get(bot, channel_id)
+        msg = await channel.get_message(message_id)
+        await msg.edit(contents[0])
+        for content in contents[1:]:
+            await channel.send(content)
+
+    async def track(
+        discord_id: int,
+        channel_id: int,
+        message_id: int,
+        ticker: str,
+        book_cost: float = None,
+        start_date: str = None,
+    ):
+        content = await track_position(
+            r=r,
+            discord_id=discord_id,
+            channel_id=channel_id,
+            ticker=ticker,
+            book_cost=book_cost,
+            start_date=start_date,
+        )
+        await reply(channel_id, message_id, [content])
+        # put the new ticker in the shared weekly price cache ahead of time;
+        # the position is tracked, so a failure here mustn't retry the job
+        try:
+            await get_weekly_closes([ticker])
+        except Exception as e:
+            printFlush(f"could not warm prices for {ticker}: {e!r}", ticker=ticker, error=repr(e))
+
+    async def track_many(discord_id: int, channel_id: int, message_id: int, text: str):
+        report = await import_text(r=r, discord_id=discord_id, channel_id=channel_id, text=text)
+        await reply(channel_id, message_id, report)
+
+    async def weekly_warm_up(run_id: str, shard_index: int, shard_count: int):
+        await warm_up_weekly_notifications(
+            r=r, run_id=run_id, shard=(shard_index, shard_count))
+
+    async def weekly_send(run_id: str, shard_index: int, shard_count: int):
+        # progress is kept per user, so a retried job resumes rather than re-sends
+        await send_weekly_notifications(
+            bot=bot, r=r, run_id=run_id, shard=(shard_index, shard_count))
+
+    return {
+        UPDATE_USER: update_user,
+        TRACK: track,
+        TRACK_MANY: track_many,
+        WEEKLY_WARM_UP: weekly_warm_up,
+        WEEKLY_SEND: weekly_send,
+    }
@@ -0,0 +1,114 @@
+from datetime import date, datetime, time, timedelta
+from functools import lru_cache
+from zoneinfo import ZoneInfo
+
+EASTERN = ZoneInfo("America/New_York")
+MARKET_OPEN = time(9, 30)
+MARKET_CLOSE = time(16, 0)
+# Yahoo's daily close is final a little after the bell
+CLOSE_SETTLED = time(16, 30)
+
+
+def now_eastern() -> datetime:
+    return datetime.now(tz=EASTERN)
+
+
+def _nth_weekday(year: int, month: int, weekday: int, n: int) -> date:
+    # n-th (1-based) given weekday of the month, or the last one for n=-1
+    if n > 0:
+        first = date(year, month, 1)
+        return first + timedelta(days=(weekday - first.weekday()) % 7 + 7 * (n - 1))
+    last = date(year + month // 12, month % 12 + 1, 1) - timedelta(days=1)
+    return last - timedelta(days=(last.weekday() - weekday) % 7)
+
+
+def _easter(year: int) -> date:
+    # anonymous Gregorian algorithm
+    a, b, c = year % 19, year // 100, year % 100
+    d, e = b // 4, b % 4
+    f = (b + 8) // 25
+    g = (b - f + 1) // 3
+    h = (19 * a + b - d - g + 15) % 30
+    i, k = c // 4, c % 4
+    l = (32 + 2 * e + 2 * i - h - k) % 7
+    m = (a + 11 * h + 22 * l) // 451
+    month, day = divmod(h + l - 7 * m + 114, 31)
+    return date(year, month, day + 1)
+
+
+def _observed(day: date) -> date:
+    # Saturday holidays close the Friday before, Sunday holidays the Monday after
+    if day.weekday() == 5:
+        return day - timedelta(days=1)
+    if day.weekday() == 6:
+        return day + timedelta(days=1)
+    return day
+
+
+@lru_cache(maxsize=None)
+def nyse_holidays(year: int) -> frozenset[date]:
+    """Full-day NYSE closures for the year."""
+    holidays = {
+        _nth_weekday(year, 1, 0, 3),  # Martin Luther King Jr. Day
+        _nth_weekday(year, 2, 0, 3),  # Washington's Birthday
+        _easter(year) - timedelta(days=2),  # Good Friday
+        _nth_weekday(year, 5, 0, -1),  # Memorial Day
+        _observed(date(year, 7, 4)),  # Independence Day
+        _nth_weekday(year, 9, 0, 1),  # Labor Day
+        _nth_weekday(year, 11, 3, 4),  # Thanksgiving
+        _observed(date(year, 12, 25)),  # Christmas
+    }
+    # New Year's Day on a Saturday is not observed on the Friday before
+    if date(year, 1, 1).weekday() != 5:
+        holidays.add(_observed(date(year, 1, 1)))
+    if year >= 2022:
+        holidays.add(_observed(date(year, 6, 19)))  # Juneteenth
+    return frozenset(holidays)
+
+
+def is_trading_day(day: date) -> bool:
+    if isinstance(day, datetime):
+        day = day.date()
+    return day.weekday() < 5 and day not in nyse_holidays(day.year)
+
+
+def is_market_open(now: datetime = None) -> bool:
+    now = (now or now_eastern()).astimezone(EASTERN)
+    return is_trading_day(now) and MARKET_OPEN <= now.time() < MARKET_CLOSE
+
+
+def next_market_open(now: datetime = None) -> datetime:
+    """The next regular session open strictly after `now`."""
+    now = (now or now_eastern()).astimezone(EASTERN)
+    day = now.date()
+    if now.time() >= MARKET_OPEN:
+        day += timedelta(days=1)
+    while not is_trading_day(day):
+        day += timedelta(days=1)
+    return datetime.combine(day, MARKET_OPEN, tzinfo=EASTERN)
+
+
+def weekly_close(now: datetime = None) -> datetime:
+    """The close of the last trading day in the week of `now`, which may be in the past."""
+    now = (now or now_eastern()).astimezone(EASTERN)
+    day = now.date() + timedelta(days=4 - now.weekday())  # Friday
+    while not is_trading_day(day):
+        day -= timedelta(days=1)
+    return datetime.combine(day, MARKET_CLOSE, tzinfo=EASTERN)
+
+
+def last_completed_session(now: datetime = None) -> date:
+    """The most recent trading day whose close is final."""
+    now = (now or now_eastern()).astimezone(EASTERN)
+    day = now.date()
+    if not (is_trading_day(day) and now.time() >= CLOSE_SETTLED):
+        day -= timedelta(days=1)
+        while not is_trading_day(day):
+            day -= timedelta(days=1)
+    return day
+
+
+def is_session_unsettled(now: datetime = None) -> bool:
+    """Whether today's session has started but its close isn't final yet."""
+    now = (now or now_eastern()).astimezone(EASTERN)
+    return is_trading_day(now) and MARKET_OPEN <= now.time() < CLOSE_SETTLED
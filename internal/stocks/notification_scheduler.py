@@ -0,0 +1,194 @@
+import asyncio
+import os
+import time
+from collections import defaultdict
+from datetime import date
+from typing import Awaitable, Callable
+
+from redis.asyncio import Redis
+
+from ..funcs.metrics import metrics
+from ..funcs.printflush import printFlush
+
+PROGRESS_KEY_PREFIX = "NOTIFY.DONE."
+PROGRESS_TTL = 60*60*24*7
+
+# https://discord.com/developers/docs/topics/rate-limits
+GLOBAL_RATE = 50  # requests per second across the bot
+CHANNEL_RATE = 5  # messages per CHANNEL_PER seconds in one channel
+CHANNEL_PER = 5
+
+
+class RateLimiter:
+    """Token bucket allowing `rate` acquisitions every `per` seconds."""
+
+    def __init__(self, rate: float, per: float = 1.0):
+        self.rate = rate
+        self.per = per
+        self._tokens = rate
+        self._updated = time.monotonic()
+        self._lock = asyncio.Lock()
+        self.waited = 0.0
+
+    async def acquire(self):
+        async with self._lock:
+            while True:
+                now = time.monotonic()
+                self._tokens = min(
+                    self.rate,
+                    self._tokens + (now - self._updated) * self.rate / self.per,
+                )
+                self._updated = now
+                if self._tokens >= 1:
+                    self._tokens -= 1
+                    return
+                delay = (1 - self._tokens) * self.per / self.rate
+                self.waited += delay
+                metrics.inc("rate_limit_wait_seconds", delay)
+                await asyncio.sleep(delay)
+
+
+class DiscordRateLimits:
+    """Client-side spacing for the global and per-channel message limits, so
+    concurrent deliveries queue here instead of tripping 429s. Every API
+    call acquires once, so `calls` counts the calls made."""
+
+    def __init__(self, global_rate: float = GLOBAL_RATE):
+        self.global_limiter = RateLimiter(global_rate)
+        self.channel_limiters: dict[int, RateLimiter] = defaultdict(
+            lambda: RateLimiter(CHANNEL_RATE, CHANNEL_PER))
+        self.calls = 0
+
+    async def acquire(self, channel_id: int | str = None):
+        self.calls += 1
+        if channel_id is not None:
+            await self.channel_limiters[int(channel_id)].acquire()
+        await self.global_limiter.acquire()
+
+    @property
+    def waited(self) -> float:
+        return self.global_limiter.waited + sum(
+            limiter.waited for limiter in self.channel_limiters.values())
+
+
+def weekly_run_id(day: date = None) -> str:
+    """Identifies a weekly run by ISO year and week."""
+    year, week, _ = (day or date.today()).isocalendar()
+    return f"{year}-W{week:02d}"
+
+
+def shard_ids(discord_ids: list[bytes], index: int = None, count: int = None) -> list[bytes]:
+    """The slice of users this process handles, from NOTIFY_SHARD_INDEX/NOTIFY_SHARD_COUNT
+    unless a shard is given."""
+    if count is None:
+        count = int(os.getenv("NOTIFY_SHARD_COUNT", 1))
+        index = int(os.getenv("NOTIFY_SHARD_INDEX", 0))
+    if count <= 1:
+        return discord_ids
+    return [id for id in discord_ids if int(id) % count == index]
+
+
+def shard_tickers(tickers: list[str], index: int = None, count: int = None) -> list[str]:
+    """The slice of sorted `tickers` this process warms, sharded like `shard_ids`."""
+    if count is None:
+        count = int(os.getenv("NOTIFY_SHARD_COUNT", 1))
+        index = int(os.getenv("NOTIFY_SHARD_INDEX", 0))
+    return tickers[index::count] if count > 1 else tickers
+
+
+class NotificationScheduler:
+    """Fans per-user jobs out with bounded concurrency, retries failures per
+    user and records finished users in Redis so a restarted run resumes."""
+
+    def __init__(
+        self,
+        r: Redis,
+        run_id: str,
+        concurrency: int = None,
+        retries: int = None,
+        backoff: float = 2.0,
+    ):
+        self.r = r
+        self.progress_key = PROGRESS_KEY_PREFIX + run_id
+        self.concurrency = concurrency or int(os.getenv("NOTIFY_CONCURRENCY", 8))
+        self.retries = retries if retries is not None else int(os.getenv("NOTIFY_RETRIES", 2))
+        self.backoff = backoff
+        self.failed: dict[bytes, Exception] = {}
+        self.completed = 0
+
+    async def pending(self, discord_ids: list[bytes]) -> list[bytes]:
+        done = await self.r.smembers(self.progress_key)
+        return [id for id in discord_ids if id not in done]
+
+    async def run(self, discord_ids: list[bytes], job: Callable[[bytes], Awaitable]):
+        semaphore = asyncio.Semaphore(self.concurrency)
+
+        async def run_one(id: bytes):
+            async with semaphore:
+                await self._run_with_retries(id, job)
+
+        start = time.perf_counter()
+        # errors stay with their user; one can't end the run while others send
+        results = await asyncio.gather(
+            *(run_one(id) for id in discord_ids), return_exceptions=True)
+        for id, result in zip(discord_ids, results):
+            if isinstance(result, Exception):
+                self.failed[id] = result
+        elapsed = time.perf_counter() - start
+        printFlush(
+            f"notified {self.completed} users in {elapsed:.1f}s, {len(self.failed)} failed",
+            event="notify_run",
+            progress_key=self.progress_key,
+            completed=self.completed,
+            failed=len(self.failed),
+            seconds=round(elapsed, 3),
+        )
+
+    async def _run_with_retries(self, id: bytes, job: Callable[[bytes], Awaitable]):
+        for attempt in range(self.retries + 1):
+            try:
+                await job(id)
+            except Exception as e:
+                if attempt == self.retries:
+                    printFlush(
+                        f"giving up on {id} after {attempt + 1} attempts: {e!r}",
+                        event="notify_failed",
+                        discord_id=id.decode("utf-8"),
+                        attempts=attempt + 1,
+                        error=repr(e),
+                    )
+                    metrics.inc("notify_failures")
+                    self.failed[id] = e
+                    return
+                delay = self.backoff * 2 ** attempt
+                metrics.inc("notify_retries")
+                printFlush(
+                    f"notification for {id} failed ({e!r}), retrying in {delay}s",
+                    event="notify_retry",
+                    discord_id=id.decode("utf-8"),
+                    attempt=attempt + 1,
+                    delay=delay,
+                    error=repr(e),
+                )
+                await asyncio.sleep(delay)
+            else:
+                metrics.inc("notify_sent")
+                self.completed += 1
+                await self._mark_done(id)
+                return
+
+    async def _mark_done(self, id: bytes):
+        # the user was notified, so a failed write is logged rather than retried
+        try:
+            pipe = self.r.pipeline()
+            pipe.sadd(self.progress_key, id)
+            pipe.expire(self.progress_key, PROGRESS_TTL)
+            await pipe.execute()
+        except Exception as e:
+            metrics.inc("notify_progress_failures")
+            printFlush(
+                f"could not record {id} as notified: {e!r}",
+                event="notify_progress_failed",
+                discord_id=id.decode("utf-8"),
+                error=repr(e),
+            )
@@ -1,66 +1,135 @@
+import asyncio
 import io
-import json
 from collections import Counter
+from datetime import timedelta
 from typing import Any, List, Tuple
 
 import interactions
 import numpy as np
 import pandas as pd
-from redis import Redis
 
+from ..funcs.metrics import metrics
 from ..funcs.printflush import printFlush
 from ..redis_connector import funcs as rds
+from ..redis_connector.data_types import DiscordUser
 from . import helpers
-from .data_types import NotificationRow
-from .stock_functions import get_latest_price, get_price_by_date
-
-
-async def send_weekly_notifications(bot: interactions.Client, r: Any):
-    discord_ids: list[bytes] = await rds.get_all_discord_ids(r=r)
-
-    for id in discord_ids:
-        await stock_update_user(bot, r, id)
-
-
-async def build_notification_rows(
-    r: Redis,
-    id: bytes,
-    latest_price: float,
-    ticker: str,
-) -> Tuple[list, int]:
-
-    curr_row = NotificationRow(ticker=ticker)
-
-    # retrieve stored data from redis
-    tracked_data = json.loads(r.hget(id, ticker).decode("utf-8"))
-
-    # get % change and icon comparing today with book cost
-    all_time_change = round(latest_price - tracked_data["book_cost"], 2)
-    all_time_pct_change = round(
-        all_time_change/tracked_data["book_cost"]*100, 2)
-
-    # get % change and icon comparing today with last week's price
-    try:
-        last_week_price = (await get_price_by_date(ticker, "-7d"))["Close"].values[0]
-        last_week_change = round(latest_price - last_week_price, 2)
-        last_week_pct_change = round(
-            last_week_change/last_week_price*100, 2)
-    except Exception as e:
-        printFlush(e)
-        last_week_change = 0
-        last_week_pct_change = 0
-
-    # the row being built out
-    curr_row.book_cost = round(tracked_data["book_cost"], 2)
-    curr_row.current_price = round(latest_price, 2)
+from .channel_cache import get_channel_cache
+from .market_hours import now_eastern
+from .notification_scheduler import (DiscordRateLimits, NotificationScheduler,
+                                     shard_ids, shard_tickers,
+                                     weekly_run_id)
+from .price_history import get_history
+from .render_pool import get_render_pool
+from .stock_functions import (WEEKLY_WINDOW_DAYS, get_latest_price,
+                              get_name_from_ticker, get_weekly_closes)
+
+
+async def _load_run_users(
+    r: Any,
+    scheduler: NotificationScheduler,
+    shard: Tuple[int, int] = None,  # (index, count), instead of the NOTIFY_SHARD_* settings
+) -> Tuple[list[bytes], list[DiscordUser]]:
+    discord_ids: list[bytes] = await scheduler.pending(
+        shard_ids(await rds.get_all_discord_ids(r=r), *(shard or ())))
+    users: list[DiscordUser] = await rds.get_users(r=r, discord_ids=discord_ids)
+    return discord_ids, users
 
-    curr_row.delta_tracked_amount = all_time_change
-    curr_row.delta_tracked_pct = str(all_time_pct_change) + "%"
 
-    curr_row.delta_week_amount = last_week_change
-    curr_row.delta_week_pct = str(last_week_pct_change) + "%"
+async def warm_up_weekly_notifications(
+    r: Any,
+    run_id: str,
+    shard: Tuple[int, int] = None,
+):
+    """Fetches what the close can't change ahead of the send: stored history
+    back past the week-ago close, and company names. Also starts the render
+    processes. The latest closes are left for the send, so tables show the
+    close rather than prices from the warm-up.
+
+    Tickers come from the tickers index; a shard warms its slice of them."""
+    tickers: list[str] = shard_tickers(
+        await rds.get_all_tracked_tickers(r=r), *(shard or ()))
+    # history and names live in Redis, so the send can run in another process
+    await get_history().fill(
+        tickers, start=now_eastern().date() - timedelta(days=WEEKLY_WINDOW_DAYS))
+    await asyncio.gather(
+        *(get_name_from_ticker(ticker=t) for t in tickers),
+        return_exceptions=True,
+    )
+    await get_render_pool().start_workers()
+    printFlush(f"warmed up {len(tickers)} tickers for {run_id}", run_id=run_id, tickers=len(tickers))
+
+
+async def send_weekly_notifications(
+    bot: interactions.Client,
+    r: Any,
+    run_id: str = None,
+    shard: Tuple[int, int] = None,
+):
+    run_id = run_id or weekly_run_id()
+    scheduler = NotificationScheduler(r=r, run_id=run_id)
+    discord_ids, users = await _load_run_users(r=r, scheduler=scheduler, shard=shard)
+    users_by_id = dict(zip(discord_ids, users))
+
+    tickers: set[str] = set()
+    for user in users:
+        tickers.update(user.stocks)
+
+    # fetch every tracked ticker once for the whole run, when the first
+    # user needs it
+    prices: pd.DataFrame = None
+    prices_lock = asyncio.Lock()
+
+    async def shared_prices() -> pd.DataFrame:
+        nonlocal prices
+        async with prices_lock:
+            if prices is None:
+                prices = await get_weekly_closes(list(tickers))
+                printFlush(
+                    f"fetched {len(tickers)} tickers for {len(discord_ids)} users",
+                    run_id=run_id, tickers=len(tickers), users=len(discord_ids))
+        return prices
+
+    rate_limits = DiscordRateLimits()
+
+    async def notify(id: bytes):
+        user = users_by_id[id]
+        if not user.stocks:
+            return
+        await stock_update_user(
+            bot,
+            r,
+            id,
+            prices=await shared_prices(),
+            user=user,
+            rate_limits=rate_limits,
+        )
 
-    return curr_row.__list__(), tracked_data["discord_channel"]
+    # tables render in parallel on the render pool as jobs run concurrently
+    await scheduler.run(discord_ids, notify)
+    printFlush(get_render_pool().summary())
+    printFlush(
+        f"waited {rate_limits.waited:.1f}s on Discord rate limits, used {rate_limits.calls} "
+        f"API calls for {scheduler.completed} users "
+        f"({rate_limits.calls / max(scheduler.completed, 1):.2f} per user)",
+        event="weekly_run",
+        run_id=run_id,
+        users=scheduler.completed,
+        failed=len(scheduler.failed),
+        discord_calls=rate_limits.calls,
+        rate_limit_wait=round(rate_limits.waited, 3),
+    )
+
+
+async def render_user_table(
+    user: DiscordUser,
+    prices: pd.DataFrame,
+) -> Tuple[bytes, int]:
+    """Builds and renders a user's table, returning PNG bytes and the channel to use."""
+    with metrics.span("table_build"):
+        table, channel_id = await build_weekly_table(user=user, prices=prices)
+    with io.BytesIO() as buffer:
+        await helpers.create_update_table(buffer, table)
+        return buffer.getvalue(), channel_id
 
 
 async def stock_update_user(
@@ -68,68 +137,89 @@ async def stock_update_user(
     r: Any,
     id: bytes,
     msg: interactions.Message = None,  # the bot's reply if invoked with /update_me
+    prices: pd.DataFrame = None,  # shared closes from get_weekly_closes
+    user: DiscordUser = None,  # pre-read hash from rds.get_users
+    rate_limits: DiscordRateLimits = None,
 ):
-    if await rds.is_user_muted(r=r, discord_id=id):
+    rate_limits = rate_limits or DiscordRateLimits()
+    if user is None:
+        user = await rds.get_user(r=r, discord_id=id)
+    if user.settings.muted:
         return  # skip muted users
 
-    tickers: list[bytes] = await rds.get_all_tickers_from_user(r=r, discord_id=id)
-    curr_data: pd.DataFrame = await get_price_by_date([t.decode("utf-8") for t in list(tickers)])
     disc_id = id.decode("utf-8")
-    table, channel_id = await build_weekly_table(r=r, disc_id=id, df=curr_data, tickers=tickers)
-
-    # create table in memory and send to Discord channel
-    with io.BytesIO() as buffer:
-        buffer = io.BytesIO()
-        await helpers.create_update_table(buffer, table)
-        buffer.seek(0)
-        file = interactions.File(fp=buffer, filename="table.png")
-
-    if not msg:  # if not invoked by a user
-        printFlush(f"sending weekly notification for {id}")
-
-        default_channel = r.hget(id, "USER_SETTINGS.DEFAULT_CHANNEL")
-        if default_channel:
-            channel_id = int(default_channel)
-        channel = await interactions.get(bot, interactions.Channel, object_id=channel_id)
-        await channel.send(f"<@{disc_id}> Weekly reminder of stocks you're tracking.\n")
-    else:
-        await msg.edit(f"<@{disc_id}> Here's a list of stocks you're tracking.\n")
-        channel_id = msg.channel_id.__str__()
-
-    channel = await interactions.get(bot, interactions.Channel, object_id=channel_id)
-    await channel.send(None, files=file)
+    if prices is None:
+        # one download covers both the latest and the week-ago close
+        prices = await get_weekly_closes(list(user.stocks))
+    png, channel_id = await render_user_table(user=user, prices=prices)
+    file = interactions.File(fp=io.BytesIO(png), filename="table.png")
+
+    # text and table go out as one message
+    if msg:  # invoked by a user; replace the placeholder reply
+        await rate_limits.acquire()
+        with metrics.span("discord_send"):
+            await msg.edit(f"<@{disc_id}> Here's a list of stocks you're tracking.\n", files=file)
+        return
+
+    printFlush(f"sending weekly notification for {id}", discord_id=disc_id)
+    if user.settings.default_channel:
+        channel_id = user.settings.default_channel
+    channels = get_channel_cache()
+    channel = await channels.get(bot, channel_id, rate_limits=rate_limits)
+    await rate_limits.acquire(channel_id)
+    try:
+        with metrics.span("discord_send"):
+            await channel.send(f"<@{disc_id}> Weekly reminder of stocks you're tracking.\n", files=file)
+    except Exception:
+        # refetch on retry in case the channel was deleted or lost access
+        channels.invalidate(channel_id)
+        raise
 
 
 async def build_weekly_table(
-    r: Redis,
-    disc_id: int,
-    tickers: str,
-    df: pd.DataFrame
+    user: DiscordUser,
+    prices: pd.DataFrame,
 ) -> Tuple[pd.DataFrame, int]:
-    msg_headers = [
-        "Ticker",
-        "Book Cost",
-        "Current Price",
-        "$ Δ Inception",
-        "ROI Inception",
-        # "Δ vs. Last Week -->",
-        "$ Δ Weekly",
-        "% Δ Weekly",
-    ]
-    channel_ids = []
-
-    curr_table: pd.DataFrame = pd.DataFrame(columns=msg_headers)
-
-    for ticker in [t.decode("utf-8") for t in tickers]:
-        latest_price = await get_latest_price(df=df, ticker=ticker)
-        curr_row, channel_id = await build_notification_rows(
-            id=disc_id,
-            r=r,
-            latest_price=latest_price,
-            ticker=ticker,
-        )
-        curr_table.loc[ticker] = np.array(curr_row)
-        channel_ids.append(channel_id)
-
-    counts = Counter(channel_ids)
+    """Builds the user's table in one vectorized pass. Columns stay numeric;
+    the renderers format them."""
+    tickers = list(user.stocks)
+    stocks = list(user.stocks.values())
+    ticker_prices = prices.reindex(tickers)
+
+    book_costs = np.array([s.book_cost for s in stocks], dtype=np.float64)
+    latest_prices = ticker_prices["Close"].to_numpy(dtype=np.float64)
+    last_week_prices = ticker_prices["Week Ago Close"].to_numpy(dtype=np.float64)
+
+    # fall back to a live quote for tickers the bulk download missed
+    for i in np.flatnonzero(np.isnan(latest_prices)):
+        latest_prices[i] = await get_latest_price(
+            df=ticker_prices.iloc[[i]], ticker=tickers[i])
+
+    # get change comparing today with book cost and with last week's price
+    all_time_change = latest_prices - book_costs
+    has_last_week = ~np.isnan(last_week_prices) & (last_week_prices != 0)
+    if not has_last_week.all():
+        printFlush(
+            f"no close from last week for {np.array(tickers)[~has_last_week].tolist()}")
+    last_week_change = np.where(has_last_week, latest_prices - last_week_prices, 0)
+    with np.errstate(divide="ignore", invalid="ignore"):
+        all_time_pct_change = all_time_change / book_costs * 100
+        last_week_pct_change = np.where(
+            has_last_week, last_week_change / last_week_prices * 100, 0)
+
+    curr_table = pd.DataFrame(
+        {
+            "Ticker": tickers,
+            "Book Cost": book_costs,
+            "Current Price": latest_prices,
+            "$ Δ Inception": all_time_change,
+            "ROI Inception": all_time_pct_change,
+            # "Δ vs. Last Week -->",
+            "$ Δ Weekly": last_week_change,
+            "% Δ Weekly": last_week_pct_change,
+        },
+        index=tickers,
+    ).round(2)
+
+    counts = Counter(s.discord_channel for s in stocks)
     return curr_table, counts.most_common(1)[0][0]
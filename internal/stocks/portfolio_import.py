@@ -0,0 +1,215 @@
+import asyncio
+import csv
+import io
+from dataclasses import dataclass
+from datetime import datetime, timedelta
+
+from redis.asyncio import Redis
+
+from ..funcs.printflush import printFlush
+from ..redis_connector import funcs as rds
+from ..redis_connector.data_types import TrackedStock
+from .price_history import get_history
+from .stock_functions import (get_name_from_ticker, get_price_by_date,
+                              get_weekly_closes)
+
+MAX_IMPORT_ROWS = 100
+MAX_MESSAGE_LENGTH = 2000
+
+
+@dataclass
+class ImportRow:
+    line: int
+    ticker: str
+    book_cost: float = None
+    start_date: str = None
+    error: str = None
+    company: str = None
+    tracked_stock: TrackedStock = None
+
+
+def parse_positions(text: str) -> list[ImportRow]:
+    """Parses `ticker[,book_cost[,YYYY-MM-DD]]` rows separated by newlines or `;`."""
+    rows = []
+    lines = text.replace(";", "\n").splitlines()
+    for line, fields in enumerate(csv.reader(lines), start=1):
+        fields = [f.strip() for f in fields]
+        if not fields or not fields[0] or fields[0].lower() == "ticker":
+            continue  # blank line or header
+
+        row = ImportRow(line=line, ticker=fields[0].upper())
+        try:
+            if len(fields) > 1 and fields[1]:
+                row.book_cost = float(fields[1])
+            if len(fields) > 2 and fields[2]:
+                datetime.strptime(fields[2], r"%Y-%m-%d")
+                row.start_date = fields[2]
+        except ValueError:
+            row.error = "book cost must be a number and the date YYYY-MM-DD"
+        rows.append(row)
+    return rows
+
+
+async def import_positions(r: Redis, discord_id: int, channel_id: int, rows: list[ImportRow]) -> list[ImportRow]:
+    """Validates every row with batched downloads and tracks the valid ones in
+    one Redis transaction. Errors are recorded on each row."""
+    valid = [row for row in rows if row.error is None]
+    tickers = sorted({row.ticker for row in valid})
+    dated = [row for row in valid if row.start_date]
+
+    # one bulk download fills the latest closes, one history fill covers every start date
+    fills = [get_weekly_closes(tickers)]
+    if dated:
+        days = [datetime.strptime(row.start_date, r"%Y-%m-%d").date() for row in dated]
+        fills.append(get_history().fill(
+            sorted({row.ticker for row in dated}),
+            start=min(days) - timedelta(days=5),
+            end=max(days),
+        ))
+    await asyncio.gather(*fills)
+
+    # per-row lookups are now answered from the cache and the price history
+    prices, names = await asyncio.gather(
+        asyncio.gather(
+            *(get_price_by_date(ticker=row.ticker, date=row.start_date) for row in valid),
+            return_exceptions=True,
+        ),
+        asyncio.gather(
+            *(get_name_from_ticker(ticker=t) for t in tickers),
+            return_exceptions=True,
+        ),
+    )
+    companies = {
+        ticker: name for ticker, name in zip(tickers, names)
+        if not isinstance(name, Exception)
+    }
+
+    for row, price_data in zip(valid, prices):
+        if isinstance(price_data, Exception) or price_data.empty:
+            printFlush(f"import of `{row.ticker}` `{row.start_date}` found no data: {price_data!r}")
+            row.error = "could not find stock data; check the ticker/exchange and date"
+            continue
+
+        ts = TrackedStock(
+            ticker=row.ticker,
+            discord_channel=channel_id,
+            book_cost=price_data["Close"].values[0],
+            start_date=row.start_date,
+        )
+        if row.book_cost:
+            ts.book_cost = row.book_cost
+        elif not row.start_date:
+            ts.start_date = price_data["Date"].values[0]
+        row.tracked_stock = ts
+        row.company = companies.get(row.ticker)
+
+    await rds.add_stocks_to_user(
+        r=r,
+        discord_id=discord_id,
+        tracked_stocks=[row.tracked_stock for row in valid if row.tracked_stock],
+    )
+    return rows
+
+
+async def track_position(
+    r: Redis,
+    discord_id: int,
+    channel_id: int,
+    ticker: str,
+    book_cost: float = None,
+    start_date: str = None,
+) -> str:
+    """Validates and tracks one position for /track, returning the reply."""
+    # validate the price and look up the company name concurrently
+    price_data, company = await asyncio.gather(
+        get_price_by_date(
+            ticker=ticker,
+            date=start_date,
+        ),
+        get_name_from_ticker(ticker=ticker),
+        return_exceptions=True,
+    )
+    if isinstance(price_data, Exception):
+        raise price_data
+
+    if price_data.empty:
+        printFlush(
+            f"`/track` `{ticker}` `{book_cost}` `{start_date}` returned an empty DataFrame")
+        return "Could not find stock data. Make sure the date format and stock tickers/exchange are correct."
+
+    contents = io.StringIO()
+    if not isinstance(company, Exception):
+        contents.write(f"Tracking `{company}` for `{ticker}`\n")
+        contents.write(
+            "If this company is unexpected, make sure you specify the exchange. ")
+        contents.write(
+            "You can use my `/drop [ticker]` command to untrack this stock.\n")
+
+    else:
+        printFlush(
+            f"error occurred during `{get_name_from_ticker.__name__}`:\n{company}")
+        contents.write(f"Tracking `{ticker}`\n")
+
+    ts = TrackedStock(
+        ticker=ticker,
+        discord_channel=channel_id,
+        book_cost=price_data["Close"].values[0],
+        start_date=start_date,
+    )
+    if book_cost:
+        ts.book_cost = book_cost
+        contents.write(f"Using book cost of `{book_cost}`.")
+    elif not start_date:
+        ts.book_cost = price_data["Close"].values[0]
+        ts.start_date = price_data["Date"].values[0]
+        contents.write(
+            f"No date or price was provided. Using `{ts.book_cost}` from `{ts.start_date}`.")
+    else:
+        contents.write(
+            f"Using `{ts.book_cost}` from `{start_date}` as book price.")
+
+    resp = await rds.add_stock_to_user(
+        r=r,
+        discord_id=discord_id,
+        tracked_stock=ts,
+    )
+    if resp:
+        printFlush(f"Added `{ticker}` for `{discord_id}`")
+    else:
+        printFlush(f"Updated `{ticker}` for {discord_id}")
+    return contents.getvalue()
+
+
+async def import_text(r: Redis, discord_id: int, channel_id: int, text: str) -> list[str]:
+    """Imports the positions in /track_many's text, returning the reply messages."""
+    rows = parse_positions(text)
+    if not rows:
+        return ["Provide positions or a CSV file, e.g. `AAPL,150.5,2023-01-03; MSFT; AC.TO,,2023-02-01`"]
+    if len(rows) > MAX_IMPORT_ROWS:
+        return [f"You can import up to {MAX_IMPORT_ROWS} positions at a time."]
+
+    rows = await import_positions(r=r, discord_id=discord_id, channel_id=channel_id, rows=rows)
+    printFlush(
+        f"`/track_many` imported {sum(not row.error for row in rows)}/{len(rows)} for {discord_id}")
+    return format_import_report(rows)
+
+
+def format_import_report(rows: list[ImportRow]) -> list[str]:
+    """Per-row results, split into messages under Discord's length limit."""
+    lines = []
+    for row in rows:
+        if row.error:
+            lines.append(f"❌ `{row.ticker}` (row {row.line}): {row.error}")
+        else:
+            ts = row.tracked_stock
+            company = f" `{row.company}`" if row.company else ""
+            since = f" from `{ts.start_date}`" if ts.start_date else ""
+            lines.append(
+                f"✅ `{row.ticker}`{company}: `{round(ts.book_cost, 2)}`{since}")
+
+    messages = [""]
+    for line in lines:
+        if len(messages[-1]) + len(line) + 1 > MAX_MESSAGE_LENGTH:
+            messages.append("")
+        messages[-1] += line + "\n"
+    return messages
@@ -0,0 +1,110 @@
+import json
+import os
+import time
+from collections import OrderedDict
+from datetime import datetime
+from typing import Any
+
+from redis.asyncio import Redis
+from redis.exceptions import RedisError
+
+from ..funcs.metrics import metrics
+from ..funcs.printflush import printFlush
+from .market_hours import (CLOSE_SETTLED, EASTERN, is_market_open,
+                           is_session_unsettled, next_market_open, now_eastern)
+
+REDIS_PREFIX = "PRICE_CACHE."
+
+
+def market_ttl() -> float:
+    """Seconds a live quote stays fresh: short while the market is open,
+    until the close settles right after the bell, otherwise until the next
+    session opens."""
+    now = now_eastern()
+    if is_market_open(now):
+        return float(os.getenv("PRICE_CACHE_OPEN_TTL", 60))
+    if is_session_unsettled(now):
+        settled = datetime.combine(now.date(), CLOSE_SETTLED, tzinfo=EASTERN)
+        return (settled - now).total_seconds()
+    return (next_market_open(now) - now).total_seconds()
+
+
+class PriceCache:
+    """Two-tier price cache: an in-process LRU in front of an optional Redis tier.
+
+    Values must be JSON serializable when the Redis tier is attached.
+    A `ttl` of None never expires.
+    """
+
+    def __init__(self, max_size: int = 2048, r: Redis = None, name: str = "price"):
+        self.max_size = max_size
+        self.r = r
+        self.name = name
+        self._lru: OrderedDict[str, tuple[float, Any]] = OrderedDict()
+
+    async def get(self, key: str) -> Any:
+        entry = self._lru.get(key)
+        if entry is not None:
+            expires_at, value = entry
+            if expires_at is None or expires_at > time.time():
+                self._lru.move_to_end(key)
+                metrics.inc("cache_hits", cache=self.name, tier="memory")
+                return value
+            del self._lru[key]
+
+        if self.r is None:
+            metrics.inc("cache_misses", cache=self.name)
+            return None
+        try:
+            raw = await self.r.get(REDIS_PREFIX + key)
+        except RedisError as e:
+            printFlush(f"price cache read failed for {key}: {e}")
+            metrics.inc("cache_misses", cache=self.name)
+            return None
+        if raw is None:
+            metrics.inc("cache_misses", cache=self.name)
+            return None
+
+        metrics.inc("cache_hits", cache=self.name, tier="redis")
+        entry = json.loads(raw)
+        self._store(key, entry["value"], entry["expires_at"])
+        return entry["value"]
+
+    async def set(self, key: str, value: Any, ttl: float = None):
+        expires_at = None if ttl is None else time.time() + ttl
+        self._store(key, value, expires_at)
+
+        if self.r is None:
+            return
+        try:
+            await self.r.set(
+                REDIS_PREFIX + key,
+                json.dumps({"value": value, "expires_at": expires_at}),
+                ex=None if ttl is None else max(int(ttl), 1),
+            )
+        except RedisError as e:
+            printFlush(f"price cache write failed for {key}: {e}")
+
+    def _store(self, key: str, value: Any, expires_at: float):
+        self._lru[key] = (expires_at, value)
+        self._lru.move_to_end(key)
+        while len(self._lru) > self.max_size:
+            self._lru.popitem(last=False)
+
+
+_cache: PriceCache = None
+
+
+def get_cache() -> PriceCache:
+    """Shared cache, configured from the environment on first use."""
+    global _cache
+    if _cache is None:
+        _cache = PriceCache(
+            max_size=int(os.getenv("PRICE_CACHE_SIZE", 2048)))
+    return _cache
+
+
+def attach_redis(r: Redis):
+    """Enables the Redis tier unless PRICE_CACHE_REDIS is set to 0."""
+    if os.getenv("PRICE_CACHE_REDIS", "1") != "0":
+        get_cache().r = r
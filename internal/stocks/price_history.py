@@ -0,0 +1,141 @@
+from collections import defaultdict
+from datetime import date, timedelta
+
+import pandas as pd
+from pandas import DataFrame
+from redis.asyncio import Redis
+
+from ..funcs.printflush import printFlush
+from .market_hours import is_trading_day, last_completed_session
+from .price_provider import BULK_CHUNK_SIZE, get_provider
+
+# sorted set per ticker: score is the date ordinal, member is "<ordinal>:<close>"
+CLOSES_KEY_PREFIX = "PRICES."
+# hash of ticker -> "<first ordinal>:<last ordinal>" already fetched
+COVERAGE_KEY = "PRICES.COVERAGE"
+
+
+def closes_by_ticker(df: DataFrame, tickers: list[str]) -> dict[str, pd.Series]:
+    """Splits a yf.download frame into a close series per ticker, NaNs dropped."""
+    if df.empty:
+        return {}
+    closes = df["Close"]
+    if isinstance(closes, pd.Series):  # single ticker, flat columns
+        closes = closes.to_frame(name=tickers[0])
+    return {
+        ticker: closes[ticker].dropna()
+        for ticker in tickers if ticker in closes
+    }
+
+
+def _has_sessions(start: date, end: date) -> bool:
+    return any(
+        is_trading_day(start + timedelta(days=i))
+        for i in range((end - start).days + 1)
+    )
+
+
+class PriceHistory:
+    """Daily closes per ticker in Redis sorted sets, filled incrementally so
+    each past session is downloaded from Yahoo only once."""
+
+    def __init__(self, r: Redis):
+        self.r = r
+
+    async def get_closes(self, ticker: str, start: date, end: date) -> pd.Series:
+        """Stored closes between `start` and `end` inclusive, indexed by date."""
+        members = await self.r.zrangebyscore(
+            CLOSES_KEY_PREFIX + ticker, start.toordinal(), end.toordinal())
+        dates, closes = [], []
+        for member in members:
+            ordinal, close = member.decode("utf-8").split(":")
+            dates.append(date.fromordinal(int(ordinal)))
+            closes.append(float(close))
+        return pd.Series(closes, index=dates, dtype="float64")
+
+    def add_closes(self, ticker: str, closes: pd.Series, pipe=None):
+        key = CLOSES_KEY_PREFIX + ticker
+        pipe = pipe or self.r.pipeline()
+        for when, close in closes.items():
+            ordinal = when.date().toordinal() if hasattr(when, "date") else when.toordinal()
+            # replace anything stored for the session before adding
+            pipe.zremrangebyscore(key, ordinal, ordinal)
+            pipe.zadd(key, {f"{ordinal}:{round(float(close), 4)}": ordinal})
+        return pipe
+
+    async def _missing_ranges(self, tickers: list[str], start: date, end: date) -> dict[tuple[date, date], list[str]]:
+        coverage = await self.r.hmget(COVERAGE_KEY, tickers) if tickers else []
+        missing: dict[tuple[date, date], list[str]] = defaultdict(list)
+        for ticker, covered in zip(tickers, coverage):
+            if covered is None:
+                missing[(start, end)].append(ticker)
+                continue
+            first, last = (date.fromordinal(int(o)) for o in covered.decode("utf-8").split(":"))
+            if start < first:
+                missing[(start, first - timedelta(days=1))].append(ticker)
+            if last < end:
+                missing[(last + timedelta(days=1), end)].append(ticker)
+        return missing
+
+    async def fill(self, tickers: list[str], start: date, end: date = None):
+        """Downloads only the completed sessions in [start, end] not stored yet."""
+        end = min(end or last_completed_session(), last_completed_session())
+        if start > end:
+            return
+
+        for (range_start, range_end), range_tickers in (await self._missing_ranges(tickers, start, end)).items():
+            for i in range(0, len(range_tickers), BULK_CHUNK_SIZE):
+                chunk = range_tickers[i:i + BULK_CHUNK_SIZE]
+                try:
+                    df: DataFrame = await get_provider().download(
+                        chunk,
+                        start=range_start,
+                        end=range_end + timedelta(days=1),
+                        progress=False,
+                        threads=True,
+                    )
+                except Exception as e:
+                    printFlush(
+                        f"could not fill price history for {chunk}: {e!r}",
+                        event="yahoo_failed", call="fill", tickers=chunk, error=repr(e))
+                    continue
+
+                fetched = closes_by_ticker(df, chunk)
+                pipe = self.r.pipeline()
+                for ticker, closes in fetched.items():
+                    self.add_closes(ticker, closes, pipe=pipe)
+                await pipe.execute()
+
+                # yfinance reports failures as missing data, so only mark a
+                # ticker covered once it returned closes for a range with sessions
+                if _has_sessions(range_start, range_end):
+                    await self._extend_coverage(list(fetched), range_start, range_end)
+                else:
+                    await self._extend_coverage(chunk, range_start, range_end)
+
+    async def _extend_coverage(self, tickers: list[str], start: date, end: date):
+        if not tickers:
+            return
+        coverage = await self.r.hmget(COVERAGE_KEY, tickers)
+        updated = {}
+        for ticker, covered in zip(tickers, coverage):
+            first, last = start.toordinal(), end.toordinal()
+            if covered is not None:
+                old_first, old_last = (int(o) for o in covered.decode("utf-8").split(":"))
+                first, last = min(first, old_first), max(last, old_last)
+            updated[ticker] = f"{first}:{last}"
+        await self.r.hset(COVERAGE_KEY, mapping=updated)
+
+
+_history: PriceHistory = None
+
+
+def get_history() -> PriceHistory:
+    if _history is None:
+        raise RuntimeError("price history has no Redis attached")
+    return _history
+
+
+def attach_redis(r: Redis):
+    global _history
+    _history = PriceHistory(r)
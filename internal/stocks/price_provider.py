@@ -0,0 +1,145 @@
+import asyncio
+import functools
+import os
+from concurrent.futures import ThreadPoolExecutor
+from typing import Any, Callable
+
+from pandas import DataFrame
+
+from ..funcs.metrics import metrics
+from ..funcs.printflush import printFlush
+
+# max tickers per bulk download
+BULK_CHUNK_SIZE = 100
+
+
+# yfinance is imported on first use, in the worker thread, to keep it out of startup
+def _download(tickers: str | list[str], **kwargs) -> DataFrame:
+    import yfinance as yf
+    return yf.download(tickers, **kwargs)
+
+
+def _last_price(ticker: str) -> float:
+    import yfinance as yf
+    return yf.Ticker(ticker).fast_info.last_price
+
+
+def _info(ticker: str) -> dict:
+    import yfinance as yf
+    return yf.Ticker(ticker=ticker).get_info()
+
+
+def _release(slots: asyncio.Semaphore | asyncio.Lock, future: asyncio.Future):
+    slots.release()
+    if not future.cancelled():
+        future.exception()  # retrieved, so an abandoned call's error isn't logged as unhandled
+
+
+class PriceProvider:
+    """Runs blocking Yahoo Finance calls on a bounded thread pool so the
+    event loop stays free for the gateway and command replies.
+
+    yf.download shares module-level state between calls, so downloads run
+    one at a time on their own thread while quotes and info stay concurrent.
+    """
+
+    def __init__(
+        self,
+        max_workers: int = 4,
+        timeout: float = 30.0,
+        retries: int = 2,
+        backoff: float = 1.0,
+    ):
+        self.timeout = timeout
+        self.retries = retries
+        self.backoff = backoff
+        self._executor = ThreadPoolExecutor(
+            max_workers=max_workers,
+            thread_name_prefix="price-provider",
+        )
+        self._semaphore = asyncio.Semaphore(max_workers)
+        self._serial_executor = ThreadPoolExecutor(
+            max_workers=1,
+            thread_name_prefix="price-provider-download",
+        )
+        self._serial_lock = asyncio.Lock()
+
+    async def run(self, fn: Callable, *args, **kwargs) -> Any:
+        """Runs `fn` on the executor with a timeout, retrying with exponential backoff."""
+        return await self._run(self._executor, self._semaphore, fn, *args, **kwargs)
+
+    async def run_serial(self, fn: Callable, *args, **kwargs) -> Any:
+        """Like run, but one call at a time, for calls that aren't thread-safe."""
+        return await self._run(self._serial_executor, self._serial_lock, fn, *args, **kwargs)
+
+    async def _run(
+        self,
+        executor: ThreadPoolExecutor,
+        slots: asyncio.Semaphore | asyncio.Lock,
+        fn: Callable,
+        *args,
+        **kwargs,
+    ) -> Any:
+        loop = asyncio.get_running_loop()
+        call = functools.partial(fn, *args, **kwargs)
+        name = getattr(fn, "__name__", str(fn))
+
+        for attempt in range(self.retries + 1):
+            try:
+                # the timeout starts once a slot is free, not while queued
+                await slots.acquire()
+                try:
+                    future = loop.run_in_executor(executor, call)
+                except BaseException:
+                    slots.release()
+                    raise
+                # a timed out call keeps its thread busy, so its slot frees
+                # only when the call actually returns
+                future.add_done_callback(functools.partial(_release, slots))
+                with metrics.span("yahoo_fetch", call=name):
+                    return await asyncio.wait_for(asyncio.shield(future), timeout=self.timeout)
+            except Exception as e:
+                if attempt == self.retries:
+                    metrics.inc("yahoo_failures", call=name)
+                    raise
+                delay = self.backoff * 2 ** attempt
+                metrics.inc("yahoo_retries", call=name)
+                printFlush(
+                    f"{name} failed ({e!r}), retrying in {delay}s",
+                    event="yahoo_retry",
+                    call=name,
+                    tickers=args[0] if args else None,
+                    attempt=attempt + 1,
+                    delay=delay,
+                    error=repr(e),
+                )
+                await asyncio.sleep(delay)
+
+    async def download(self, tickers: str | list[str], **kwargs) -> DataFrame:
+        return await self.run_serial(_download, tickers, **kwargs)
+
+    async def get_last_price(self, ticker: str) -> float:
+        return await self.run(_last_price, ticker)
+
+    async def get_info(self, ticker: str) -> dict:
+        return await self.run(_info, ticker)
+
+    def shutdown(self):
+        self._executor.shutdown(wait=False, cancel_futures=True)
+        self._serial_executor.shutdown(wait=False, cancel_futures=True)
+
+
+_provider: PriceProvider = None
+
+
+def get_provider() -> PriceProvider:
+    """Shared provider, configured from the environment on first use."""
+    global _provider
+    if _provider is None:
+        _provider = PriceProvider(
+            max_workers=int(os.getenv("YAHOO_MAX_WORKERS", 4)),
+            timeout=float(os.getenv("YAHOO_TIMEOUT", 30)),
+            retries=int(os.getenv("YAHOO_RETRIES", 2)),
+            backoff=float(os.getenv("YAHOO_BACKOFF", 1)),
+        )
+    return _provider
@@ -0,0 +1,117 @@
+import asyncio
+import os
+import time
+from collections import deque
+from concurrent.futures import ProcessPoolExecutor
+from concurrent.futures.process import BrokenProcessPool
+from typing import Callable
+
+import numpy as np
+
+from ..funcs.metrics import metrics
+from ..funcs.printflush import printFlush
+
+# each worker holds a headless browser, so stay small unless RENDER_WORKERS says
+# otherwise; containers often report the host's cores, not their own share
+DEFAULT_RENDER_WORKERS = 2
+
+
+def _warm_up():
+    # start Kaleido's headless renderer once per worker instead of per image
+    if os.getenv("TABLE_RENDERER", "plotly") != "plotly":
+        return
+    import plotly.graph_objects as go
+    go.Figure().to_image(format="png", width=10, height=10)
+
+
+def _started() -> bool:
+    return True
+
+
+def _default_workers() -> int:
+    try:
+        cores = len(os.sched_getaffinity(0))
+    except AttributeError:  # not available on macOS or Windows
+        cores = os.cpu_count() or 1
+    return min(DEFAULT_RENDER_WORKERS, cores)
+
+
+class RenderPool:
+    """Process pool with warm renderers for table images, plus render timings."""
+
+    def __init__(self, max_workers: int = None, history: int = 1000):
+        self.max_workers = max_workers or _default_workers()
+        self._executor = self._start_executor()
+        self.count = 0
+        self.total_seconds = 0.0
+        self._timings: deque[float] = deque(maxlen=history)
+
+    async def render(self, fn: Callable[..., bytes], *args) -> bytes:
+        """Runs a picklable render function in a worker and returns its PNG bytes."""
+        loop = asyncio.get_running_loop()
+        start = time.perf_counter()
+        executor = self._executor
+        try:
+            png = await loop.run_in_executor(executor, fn, *args)
+        except BrokenProcessPool:
+            # a worker died (a renderer crash or OOM) and took the pool with it
+            self._replace_executor(executor)
+            png = await loop.run_in_executor(self._executor, fn, *args)
+        elapsed = time.perf_counter() - start
+        metrics.observe("image_render", elapsed)
+
+        self.count += 1
+        self.total_seconds += elapsed
+        self._timings.append(elapsed)
+        return png
+
+    async def start_workers(self):
+        """Starts every worker, and its renderer, ahead of a burst of renders."""
+        loop = asyncio.get_running_loop()
+        await asyncio.gather(*(
+            loop.run_in_executor(self._executor, _started)
+            for _ in range(self.max_workers)
+        ))
+
+    def _start_executor(self) -> ProcessPoolExecutor:
+        return ProcessPoolExecutor(
+            max_workers=self.max_workers,
+            initializer=_warm_up,
+        )
+
+    def _replace_executor(self, broken: ProcessPoolExecutor):
+        # renders that failed together replace the pool only once
+        if self._executor is not broken:
+            return
+        broken.shutdown(wait=False, cancel_futures=True)
+        self._executor = self._start_executor()
+        metrics.inc("render_pool_restarts")
+        printFlush("render pool broke, started a new one")
+
+    def summary(self) -> str:
+        if not self._timings:
+            return "no images rendered"
+        timings = np.array(self._timings)
+        return "rendered {count} images, mean {mean:.3f}s p95 {p95:.3f}s max {max:.3f}s".format(
+            count=self.count,
+            mean=timings.mean(),
+            p95=np.percentile(timings, 95),
+            max=timings.max(),
+        )
+
+    def shutdown(self):
+        self._executor.shutdown(wait=False, cancel_futures=True)
+
+
+_pool: RenderPool = None
+
+
+def get_render_pool() -> RenderPool:
+    """Shared pool sized by RENDER_WORKERS, defaulting to DEFAULT_RENDER_WORKERS
+    or fewer if fewer cores are available."""
+    global _pool
+    if _pool is None:
+        workers = os.getenv("RENDER_WORKERS")
+        _pool = RenderPool(max_workers=int(workers) if workers else None)
+        printFlush(f"started render pool with {_pool.max_workers} workers")
+    return _pool
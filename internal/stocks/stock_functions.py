@@ -2,10 +2,36 @@ from datetime import datetime, timedelta
 
 import numpy as np
 import pandas as pd
-import yfinance as yf
 from pandas import DataFrame
 
 from ..funcs.printflush import printFlush
+from .market_hours import is_session_unsettled, now_eastern
+from .price_cache import get_cache, market_ttl
+from .price_history import closes_by_ticker, get_history
+from .price_provider import BULK_CHUNK_SIZE, get_provider
+
+# daily window wide enough to hold the latest close and the close a week ago
+WEEKLY_WINDOW_DAYS = 12
+
+
+def _close_ttl(date: str = None) -> float:
+    # a close from a past session never changes
+    if date and datetime.strptime(date, r"%Y-%m-%d").date() < now_eastern().date():
+        return None
+    return market_ttl()
+
+
+def _records_from_frame(df: DataFrame) -> list[dict]:
+    return [
+        {"Date": str(row.Date), "Close": float(row.Close)}
+        for row in df.itertuples()
+    ]
+
+
+def _frame_from_records(records: list[dict]) -> DataFrame:
+    df = DataFrame(records, columns=["Date", "Close"])
+    df["Date"] = [datetime.strptime(d, r"%Y-%m-%d").date() for d in df["Date"]]
+    return df
 
 
 async def get_price_by_date(ticker: bytes | str, date: str = None) -> DataFrame:
@@ -13,19 +39,33 @@ async def get_price_by_date(ticker: bytes | str, date: str = None) -> DataFrame:
     if type(ticker) is bytes:
         ticker = ticker.decode("utf-8")
 
+    cache_key = f"close:{ticker}:{date or 'latest'}"
+    cached = await get_cache().get(cache_key)
+    if cached is not None:
+        return _frame_from_records(cached)
+
+    # past sessions come from the local history, fetching only what's missing
+    if date and _close_ttl(date) is None:
+        day = datetime.strptime(date, r"%Y-%m-%d").date()
+        history = get_history()
+        await history.fill([ticker], start=day - timedelta(days=5), end=day)
+        closes = await history.get_closes(
+            ticker, day - timedelta(days=5), day - timedelta(days=1))
+        if not closes.empty:
+            df = DataFrame({"Date": [closes.index[-1]], "Close": [closes.values[-1]]}).round(2)
+            await get_cache().set(cache_key, _records_from_frame(df), ttl=None)
+            return df
+
     # if no given date, take the most recent price
     # 4 day window to account for weekends
     if not date:
         start_date = datetime.today() - timedelta(days=5)
         end_date = None
-    elif date == "-7d":
-        start_date = datetime.today() - timedelta(days=7)
-        end_date = start_date + timedelta(days=5)
     else:
         start_date = datetime.strptime(date, r"%Y-%m-%d") - timedelta(days=5)
         end_date = start_date + timedelta(days=5)
 
-    df: DataFrame = yf.download(
+    df: DataFrame = await get_provider().download(
         ticker,
         start=start_date,
         end=end_date,
@@ -33,10 +73,7 @@ async def get_price_by_date(ticker: bytes | str, date: str = None) -> DataFrame:
         threads=True,
     )
 
-    if date == "-7d":
-        df = df.head(1).reset_index()
-    else:
-        df = df.tail(1).reset_index()
+    df = df.tail(1).reset_index()
 
     try:
         df = df[['Datetime', 'Close']]
@@ -47,9 +84,96 @@ async def get_price_by_date(ticker: bytes | str, date: str = None) -> DataFrame:
         df.rename({"Datetime": "Date"}, axis="columns", inplace=True)
         df['Date'] = df['Date'].dt.date
     df = df.round(2)
+
+    if not df.empty:
+        await get_cache().set(cache_key, _records_from_frame(df), ttl=_close_ttl(date))
     return df
 
 
+async def get_weekly_closes(tickers: list[bytes | str]) -> DataFrame:
+    """Latest close and week-ago close for every ticker, indexed by ticker.
+
+    Tickers are deduplicated and served from the price cache where possible.
+    The rest come from the local price history, with only today's unsettled
+    close fetched live in bulk.
+    """
+    tickers = sorted({
+        t.decode("utf-8") if type(t) is bytes else t for t in tickers
+    })
+    today = now_eastern().date()
+    start_date = today - timedelta(days=WEEKLY_WINDOW_DAYS)
+    week_ago = today - timedelta(days=7)
+    cache = get_cache()
+
+    closes: dict[str, list[float]] = {}
+    missing: list[str] = []
+    for ticker in tickers:
+        cached = await cache.get(f"weekly:{ticker}")
+        if cached is None:
+            missing.append(ticker)
+        else:
+            closes[ticker] = [np.nan if c is None else c for c in cached]
+
+    history = get_history()
+    await history.fill(missing, start=start_date)
+    live = await download_latest_closes(missing) if is_session_unsettled() else {}
+
+    for ticker in missing:
+        stored = await history.get_closes(ticker, start_date, today)
+        week_series = stored[stored.index >= week_ago]
+        if ticker in live:
+            latest, latest_date = live[ticker], today
+        elif not stored.empty:
+            latest, latest_date = stored.values[-1], stored.index[-1]
+        else:
+            latest, latest_date = np.nan, None
+        closes[ticker] = [
+            latest,
+            week_series.values[0] if not week_series.empty else np.nan,
+        ]
+        if not np.isnan(latest):
+            await cache.set(
+                f"weekly:{ticker}",
+                [None if np.isnan(c) else float(c) for c in closes[ticker]],
+                ttl=market_ttl(),
+            )
+            # lets /track answer from the cache for tickers the run already fetched
+            await cache.set(
+                f"close:{ticker}:latest",
+                [{"Date": str(latest_date), "Close": round(float(latest), 2)}],
+                ttl=market_ttl(),
+            )
+
+    return DataFrame.from_dict(
+        closes,
+        orient="index",
+        columns=["Close", "Week Ago Close"],
+    ).reindex(tickers).round(2)
+
+
+async def download_latest_closes(tickers: list[str]) -> dict[str, float]:
+    # on failure the stored closes are used instead, so Yahoo outages don't break updates
+    latest: dict[str, float] = {}
+    for i in range(0, len(tickers), BULK_CHUNK_SIZE):
+        chunk = tickers[i:i + BULK_CHUNK_SIZE]
+        try:
+            df: DataFrame = await get_provider().download(
+                chunk,
+                period="5d",
+                progress=False,
+                threads=True,
+            )
+        except Exception as e:
+            printFlush(
+                f"could not download latest closes for {chunk}: {e!r}",
+                event="yahoo_failed", call="download_latest_closes", tickers=chunk, error=repr(e))
+            continue
+        for ticker, series in closes_by_ticker(df, chunk).items():
+            if not series.empty:
+                latest[ticker] = series.values[-1]
+    return latest
+
+
 async def get_latest_price(ticker: str, df: pd.DataFrame):
     # get latest price data. try/except in case bugs during grabbing price
     if not isinstance(df.keys(), pd.MultiIndex):
@@ -57,16 +181,27 @@ async def get_latest_price(ticker: str, df: pd.DataFrame):
     else:
         latest_price = df["Close"][ticker].values[0]
     if np.isnan(latest_price):
+        cached = await get_cache().get(f"last:{ticker}")
+        if cached is not None:
+            return cached
         try:
-            latest_price = yf.Ticker(ticker).fast_info.last_price
+            latest_price = await get_provider().get_last_price(ticker)
         except Exception as e:
             printFlush(
                 f"error during {get_latest_price.__name__}:\n{e}")
             # attempt redownload
-            latest_price = yf.download(ticker, period=5).tail(1)[
-                "Close"].values[0]
+            latest_price = (await get_provider().download(
+                ticker, period="5d", progress=False)).tail(1)["Close"].values[0]
+        if not np.isnan(latest_price):
+            await get_cache().set(f"last:{ticker}", float(latest_price), ttl=market_ttl())
     return latest_price
 
 
 async def get_name_from_ticker(ticker: str) -> str:
-    return yf.Ticker(ticker=ticker).get_info()["longName"]
+    cached = await get_cache().get(f"name:{ticker}")
+    if cached is not None:
+        return cached
+    name = (await get_provider().get_info(ticker))["longName"]
+    # a ticker's company name is effectively fixed, so never expire it
+    await get_cache().set(f"name:{ticker}", name, ttl=None)
+    return name
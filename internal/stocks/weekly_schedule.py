@@ -0,0 +1,75 @@
+import asyncio
+import os
+from datetime import datetime, timedelta
+
+import interactions
+from redis.asyncio import Redis
+
+from ..funcs.printflush import printFlush
+from ..redis_connector.job_queue import JobQueue
+from .jobs import enqueue_weekly_send, enqueue_weekly_warm_up
+from .market_hours import now_eastern, weekly_close
+from .notification_scheduler import weekly_run_id
+from .notifications import (send_weekly_notifications,
+                            warm_up_weekly_notifications)
+
+LAST_RUN_KEY = "SCHEDULER.LAST_WEEKLY_RUN"
+
+
+async def sleep_until(when: datetime):
+    # one long sleep; loop only in case the timer wakes early
+    while (remaining := (when - now_eastern()).total_seconds()) > 0:
+        await asyncio.sleep(remaining)
+
+
+async def next_weekly_run(r: Redis, now: datetime = None) -> datetime:
+    """This week's close if it hasn't been sent yet (catching up on a missed
+    send within WEEKLY_CATCH_UP_HOURS), otherwise next week's close."""
+    now = now or now_eastern()
+    send_at = weekly_close(now)
+    last_run = await r.get(LAST_RUN_KEY)
+    catch_up = timedelta(hours=float(os.getenv("WEEKLY_CATCH_UP_HOURS", 12)))
+
+    already_sent = last_run is not None and last_run.decode("utf-8") == weekly_run_id(send_at.date())
+    if already_sent or now - send_at > catch_up:
+        send_at = weekly_close(now + timedelta(days=7 - now.weekday()))
+    return send_at
+
+
+async def run_weekly_schedule(bot: interactions.Client, r: Redis, queue: JobQueue = None):
+    """Sleeps until each week's last market close in US/Eastern and sends the
+    weekly notifications exactly once per week, across restarts.
+
+    With a `queue`, the warm-up and send are enqueued for the workers instead
+    of running in this process."""
+    while True:
+        send_at = await next_weekly_run(r=r)
+        run_id = weekly_run_id(send_at.date())
+        printFlush(f"Next weekly notification at {send_at.isoformat()}")
+
+        # fetch and render ahead of the send so delivery is all that's left
+        warm_up_lead = timedelta(minutes=float(os.getenv("WARMUP_LEAD_MINUTES", 10)))
+        if warm_up_lead and now_eastern() < send_at - warm_up_lead:
+            await sleep_until(send_at - warm_up_lead)
+            try:
+                if queue:
+                    await enqueue_weekly_warm_up(queue, run_id)
+                else:
+                    await warm_up_weekly_notifications(r=r, run_id=run_id)
+            except Exception as e:
+                printFlush(f"warm-up for {run_id} failed: {e!r}", run_id=run_id, error=repr(e))
+        await sleep_until(send_at)
+
+        try:
+            if queue:
+                # the stream keeps the jobs until a worker finishes them
+                await enqueue_weekly_send(queue, run_id)
+            else:
+                await send_weekly_notifications(bot=bot, r=r, run_id=run_id)
+        except Exception as e:
+            # progress is kept per user, so retrying resumes rather than re-sends
+            printFlush(f"weekly notification run {run_id} failed: {e!r}", run_id=run_id, error=repr(e))
+            await asyncio.sleep(60)
+            continue
+        await r.set(LAST_RUN_KEY, run_id)
+        printFlush("Weekly notification queued" if queue else "Weekly notification sent")
@@ -1,32 +1,91 @@
 
 import asyncio
-import datetime
+import importlib
 import os
-from datetime import date
+import time
+
+boot_started = time.perf_counter()
 
 import interactions
-import redis
-from discord.ext import tasks
 from dotenv import load_dotenv
+from redis.exceptions import RedisError
 
+from internal.funcs.metrics import metrics, start_exporters
 from internal.funcs.printflush import printFlush
-from internal.redis_connector.data_types import *
-from internal.redis_connector.funcs import *
-from internal.stocks.notifications import *
-from internal.stocks.stock_functions import *
+from internal.redis_connector.client import create_redis
+from internal.redis_connector.data_types import ALERT_KINDS, PriceAlert
+from internal.redis_connector.funcs import (drop_stock_from_user,
+                                            get_feedback_blacklist, get_user,
+                                            indexes_outdated,
+                                            migrate_tracked_stocks,
+                                            rebuild_indexes, remove_alert,
+                                            set_alert, set_default_channel,
+                                            set_feedback_blacklisted,
+                                            set_muted)
+from internal.redis_connector.job_queue import JobQueue
+from internal.stocks import price_cache
+from internal.stocks.channel_cache import get_channel_cache
+
+metrics.observe("startup", time.perf_counter() - boot_started, phase="imports")
+printFlush(f"imported core modules in {time.perf_counter() - boot_started:.2f}s")
 
 load_dotenv()
-
-intents = interactions.Intents.ALL
+FEEDBACK_CHANNEL = os.getenv("FEEDBACK_CHANNEL")
+ADMIN_ID = os.getenv("ADMIN_ID")
+
+# slash commands need no intents; messages are only read for DMs and the
+# admin commands in the feedback channel, channel events keep caches valid
+intents = (
+    interactions.Intents.GUILDS
+    | interactions.Intents.GUILD_MESSAGES
+    | interactions.Intents.GUILD_MESSAGE_CONTENT
+    | interactions.Intents.DIRECT_MESSAGES
+)
 bot = interactions.Client(
     token=os.getenv("TOKEN"),
     intents=intents,
 )
-r = redis.Redis(
-    host=os.getenv("REDIS_HOST"),
-    port=os.getenv("REDIS_PORT"),
-    password=os.getenv("REDIS_PASSWORD"),
+r = create_redis()
+price_cache.attach_redis(r)
+background_tasks: set[asyncio.Task] = set()
+# discord ids blocked from sending feedback, refreshed from Redis
+feedback_blacklist: set[int] = set()
+# with JOB_QUEUE=1, updates, weekly runs and alerts run in worker.py and this
+# process only replies and enqueues
+job_queue = JobQueue(r) if os.getenv("JOB_QUEUE", "0") == "1" else None
+
+# the pandas/numpy/yfinance stack loads in a thread once the gateway is up,
+# so it doesn't hold up connecting
+STOCK_MODULES = (
+    "internal.stocks.notifications",
+    "internal.stocks.alerts",
+    "internal.stocks.portfolio_import",
+    "internal.stocks.weekly_schedule",
+    "internal.stocks.jobs",
 )
+stock_modules_loaded: asyncio.Task = None
+
+
+def import_stock_modules():
+    for name in STOCK_MODULES:
+        importlib.import_module(name)
+
+
+async def _load_stock_modules():
+    start = time.perf_counter()
+    await asyncio.to_thread(import_stock_modules)
+    from internal.stocks import price_history
+    price_history.attach_redis(r)
+    metrics.observe("startup", time.perf_counter() - start, phase="stock_modules")
+    printFlush(f"loaded stock modules in {time.perf_counter() - start:.2f}s")
+
+
+async def load_stock_modules():
+    """Returns once the stock modules are imported, starting the import on first call."""
+    global stock_modules_loaded
+    if stock_modules_loaded is None:
+        stock_modules_loaded = asyncio.create_task(_load_stock_modules())
+    await asyncio.shield(stock_modules_loaded)
 
 
 @bot.command(
@@ -61,63 +120,100 @@ async def track(
     printFlush(f"`/track` invoked by {ctx.author.name} ({ctx.author.id})")
     stock_ticker = stock_ticker.upper()
 
-    # get stock price
     msg = await ctx.send("One moment... This may take several seconds, depending on Yahoo Finance.")
-    price_data = await get_price_by_date(
-        ticker=stock_ticker,
-        date=start_date,
-    )
-
-    if price_data.empty:
-        printFlush(
-            f"`/{track.name}` `{stock_ticker}` `{book_cost}` `{start_date}` returned an empty DataFrame")
-        await msg.edit("Could not find stock data. Make sure the date format and stock tickers/exchange are correct.")
-    else:
-        contents = io.StringIO()
-        try:
-            company = await get_name_from_ticker(ticker=stock_ticker)
-            contents.write(f"Tracking `{company}` for `{stock_ticker}`\n")
-            contents.write(
-                "If this company is unexpected, make sure you specify the exchange. ")
-            contents.write(
-                "You can use my `/drop [ticker]` command to untrack this stock.\n")
-
-        except Exception as e:
-            printFlush(
-                f"error occurred during `{get_name_from_ticker.__name__}`:\n{e}")
-            contents.write(f"Tracking `{stock_ticker}`\n")
-
-        ts = TrackedStock(
+    await load_stock_modules()
+    from internal.stocks.jobs import TRACK
+    from internal.stocks.portfolio_import import track_position
+    from internal.stocks.stock_functions import get_weekly_closes
+
+    if job_queue:
+        # a worker edits the placeholder once the position is tracked
+        await job_queue.enqueue(
+            TRACK,
+            discord_id=ctx.author.id.__int__(),
+            channel_id=msg.channel_id.__int__(),
+            message_id=msg.id.__int__(),
             ticker=stock_ticker,
-            discord_channel=ctx.channel_id.__int__(),
-            book_cost=price_data["Close"].values[0],
+            book_cost=book_cost,
             start_date=start_date,
         )
-        if book_cost:
-            ts.book_cost = book_cost
-            contents.write(f"Using book cost of `{book_cost}`.")
-            await msg.edit(contents.getvalue())
-        elif not start_date:
-            ts.book_cost = price_data["Close"].values[0]
-            ts.start_date = price_data["Date"].values[0]
-            contents.write(
-                f"No date or price was provided. Using `{ts.book_cost}` from `{ts.start_date}`.")
-            await msg.edit(contents.getvalue())
-        else:
-            contents.write(
-                f"Using `{ts.book_cost}` from `{start_date}` as book price.")
-            await msg.edit(contents.getvalue())
-
-        resp = await add_stock_to_user(
-            r=r,
-            discord_id=ctx.author.id,
-            tracked_stock=ts,
+        printFlush(f"`/{track.name}` queued")
+        return
+
+    content = await track_position(
+        r=r,
+        discord_id=ctx.author.id.__int__(),
+        channel_id=ctx.channel_id.__int__(),
+        ticker=stock_ticker,
+        book_cost=book_cost,
+        start_date=start_date,
+    )
+    await msg.edit(content)
+
+    # put the new ticker in the shared weekly price cache ahead of time
+    task = asyncio.create_task(get_weekly_closes([stock_ticker]))
+    background_tasks.add(task)
+    task.add_done_callback(background_tasks.discard)
+    printFlush(f"`/{track.name}` complete")
+
+
+@bot.command(
+    options=[
+        interactions.Option(
+            name="positions",
+            description="(Optional) `TICKER,book_cost,YYYY-MM-DD` rows separated by `;`. Cost and date optional.",
+            type=interactions.OptionType.STRING,
+            required=False,
+        ),
+        interactions.Option(
+            name="csv_file",
+            description="(Optional) CSV file with ticker, book_cost and start_date columns.",
+            type=interactions.OptionType.ATTACHMENT,
+            required=False,
+        ),
+    ]
+)
+async def track_many(
+    ctx: interactions.CommandContext,
+    positions: str = None,
+    csv_file: interactions.Attachment = None,
+):
+    """Tracks many stocks at once from a list or a CSV file."""
+    printFlush(
+        f"`/{track_many.name}` invoked by {ctx.author.name} ({ctx.author.id})")
+
+    # reply within Discord's deadline; the modules and the CSV can take longer
+    msg = await ctx.send("One moment... This may take several seconds, depending on Yahoo Finance.")
+    await load_stock_modules()
+    from internal.stocks.jobs import TRACK_MANY
+    from internal.stocks.portfolio_import import import_text
+
+    text = positions or ""
+    if csv_file:
+        text += "\n" + (await csv_file.download()).read().decode("utf-8-sig")
+
+    if job_queue:
+        # a worker validates, tracks and edits the placeholder with the report
+        await job_queue.enqueue(
+            TRACK_MANY,
+            discord_id=ctx.author.id.__int__(),
+            channel_id=msg.channel_id.__int__(),
+            message_id=msg.id.__int__(),
+            text=text,
         )
-        if resp:
-            printFlush(f"Added `{stock_ticker}` for `{ctx.author.id}`")
-        else:
-            printFlush(f"Updated `{stock_ticker}` for {ctx.author.id}")
-        printFlush(f"`/{track.name}` complete")
+        printFlush(f"`/{track_many.name}` queued")
+        return
+
+    report = await import_text(
+        r=r,
+        discord_id=ctx.author.id.__int__(),
+        channel_id=ctx.channel_id.__int__(),
+        text=text,
+    )
+    await msg.edit(report[0])
+    for content in report[1:]:
+        await ctx.send(content)
+    printFlush(f"`/{track_many.name}` complete")
 
 
 @ bot.command(
@@ -152,16 +248,108 @@ async def drop(
     printFlush(f"`/{drop.name}` complete")
 
 
+ALERT_KIND_OPTION = interactions.Option(
+    name="kind",
+    description="`above`/`below` a price, or `move` by a percent from your book cost.",
+    type=interactions.OptionType.STRING,
+    required=True,
+    choices=[interactions.Choice(name=kind, value=kind) for kind in ALERT_KINDS],
+)
+
+
+@bot.command(
+    options=[
+        interactions.Option(
+            name="stock_ticker",
+            description="A ticker you're tracking.",
+            type=interactions.OptionType.STRING,
+            required=True,
+        ),
+        ALERT_KIND_OPTION,
+        interactions.Option(
+            name="threshold",
+            description="A price for above/below, or a percent such as `10` or `-5` for move.",
+            type=interactions.OptionType.NUMBER,
+            required=True,
+        ),
+    ]
+)
+async def alert(
+    ctx: interactions.CommandContext,
+    stock_ticker: str,
+    kind: str,
+    threshold: float,
+):
+    """Notifies you during market hours when a tracked stock crosses a threshold."""
+    printFlush(
+        f"`/{alert.name}` invoked by {ctx.author.name} ({ctx.author.id})")
+    stock_ticker = stock_ticker.upper()
+    user = await get_user(r=r, discord_id=ctx.author.id.__int__())
+    if stock_ticker not in user.stocks:
+        await ctx.send(f"Track `{stock_ticker}` with `/track` before setting an alert on it.", ephemeral=True)
+        return
+    if kind == "move" and threshold == 0:
+        await ctx.send("A move alert needs a non-zero percent, e.g. `10` or `-5`.", ephemeral=True)
+        return
+
+    price_alert = PriceAlert(
+        ticker=stock_ticker,
+        kind=kind,
+        threshold=threshold,
+        discord_channel=ctx.channel_id.__int__(),
+    )
+    await set_alert(r=r, discord_id=ctx.author.id.__int__(), alert=price_alert)
+    await ctx.send(f"You'll be notified here when {price_alert.describe()}.", ephemeral=True)
+    printFlush(f"`/{alert.name}` complete")
+
+
+@bot.command(
+    options=[
+        interactions.Option(
+            name="stock_ticker",
+            description="The ticker the alert is on.",
+            type=interactions.OptionType.STRING,
+            required=True,
+        ),
+        ALERT_KIND_OPTION,
+    ]
+)
+async def drop_alert(
+    ctx: interactions.CommandContext,
+    stock_ticker: str,
+    kind: str,
+):
+    """Removes one of your price alerts."""
+    printFlush(
+        f"`/{drop_alert.name}` invoked by {ctx.author.name} ({ctx.author.id})")
+    stock_ticker = stock_ticker.upper()
+    if await remove_alert(r=r, discord_id=ctx.author.id.__int__(), ticker=stock_ticker, kind=kind):
+        await ctx.send(f"Removed your `{kind}` alert on `{stock_ticker}`.", ephemeral=True)
+    else:
+        await ctx.send(f"You don't have a `{kind}` alert on `{stock_ticker}`.", ephemeral=True)
+    printFlush(f"`/{drop_alert.name}` complete")
+
+
+@bot.command()
+async def alerts(ctx: interactions.CommandContext):
+    """Lists your price alerts."""
+    printFlush(
+        f"`/{alerts.name}` invoked by {ctx.author.name} ({ctx.author.id})")
+    user = await get_user(r=r, discord_id=ctx.author.id.__int__())
+    if user.alerts:
+        lines = sorted(f"- {a.describe()}" for a in user.alerts)
+        await ctx.send("Your alerts:\n" + "\n".join(lines), ephemeral=True)
+    else:
+        await ctx.send("You have no alerts. Set one with `/alert`.", ephemeral=True)
+    printFlush(f"`/{alerts.name}` complete")
+
+
 @bot.command()
 async def mute(ctx: interactions.CommandContext):
     """Prevents the bot from mentioning/pinging you during updates."""
     printFlush(
         f"`/{mute.name}` invoked by {ctx.author.name} ({ctx.author.id})")
-    r.hset(
-        ctx.author.id.__int__(),
-        "USER_SETTINGS.MUTED",
-        1,
-    )
+    await set_muted(r=r, discord_id=ctx.author.id.__int__(), muted=True)
     await ctx.send("You will no longer be pinged on weekly updates.",
                    ephemeral=True
                    )
@@ -173,11 +361,7 @@ async def unmute(ctx: interactions.CommandContext):
     """Allows the bot to mention/ping you during updates."""
     printFlush(
         f"`/{unmute.name}` invoked by {ctx.author.name} ({ctx.author.id})")
-    r.hset(
-        ctx.author.id.__int__(),
-        "USER_SETTINGS.MUTED",
-        0,
-    )
+    await set_muted(r=r, discord_id=ctx.author.id.__int__(), muted=False)
     await ctx.send("You will now be pinged on weekly updates.",
                    ephemeral=True
                    )
@@ -186,45 +370,61 @@ async def unmute(ctx: interactions.CommandContext):
 
 @bot.event
 async def on_message_create(msg: interactions.Message):
+    # only DMs and the admin's messages in the feedback channel need any work;
+    # everything else is dropped before touching Discord or Redis
+    is_dm = not msg.guild_id
     if msg.author.id == bot.me.id:
         return
+    if not is_dm and not (msg.channel_id == FEEDBACK_CHANNEL and msg.author.id == ADMIN_ID):
+        return
+    if is_dm and msg.author.id.__int__() in feedback_blacklist:
+        return
 
-    channel: interactions.Channel = await interactions.get(
-        bot,
-        interactions.Channel,
-        object_id=os.getenv("FEEDBACK_CHANNEL")
-    )
-
-    if not msg.guild_id:
-
-        if not await is_user_fb_blacklisted(r=r, discord_id=msg.author.id.__int__()):
-            printFlush(f"Received DM from {msg.author} ({msg.author.id})")
-            from_user = "({id}) Feedback from `{user}#{tag}`:\n".format(
-                id=msg.author.id,
-                user=msg.author.username,
-                tag=msg.author.discriminator,
-            )
-            pics = "\n"
-            if msg.attachments:
-                for attachment in msg.attachments:
-                    pics += f"{attachment.url}\n"
-            await channel.send(from_user + msg.content + pics)
-    elif msg.channel_id == os.getenv("FEEDBACK_CHANNEL") \
-            and msg.author.id == os.getenv("ADMIN_ID") \
-            and msg.content.split(" ")[0] == "!force_notify":
+    channel: interactions.Channel = await get_channel_cache().get(bot, FEEDBACK_CHANNEL)
 
+    if is_dm:
+        printFlush(f"Received DM from {msg.author} ({msg.author.id})")
+        from_user = "({id}) Feedback from `{user}#{tag}`:\n".format(
+            id=msg.author.id,
+            user=msg.author.username,
+            tag=msg.author.discriminator,
+        )
+        pics = "\n"
+        if msg.attachments:
+            for attachment in msg.attachments:
+                pics += f"{attachment.url}\n"
+        await channel.send(from_user + msg.content + pics)
+    elif msg.content.split(" ")[0] == "!force_notify":
+
+        await load_stock_modules()
+        from internal.stocks.jobs import UPDATE_USER, enqueue_weekly_send
+        from internal.stocks.notifications import (send_weekly_notifications,
+                                                   stock_update_user)
         if msg.content.split(" ")[1] == "all" \
                 and bot.me.id == os.getenv("TEST_BOT_ID"):
-            await send_weekly_notifications(bot=bot, r=r)
-
+            # a fresh run id so users already notified this week are included
+            if job_queue:
+                await enqueue_weekly_send(job_queue, f"force-{msg.id}")
+            else:
+                await send_weekly_notifications(bot=bot, r=r, run_id=f"force-{msg.id}")
+
+        if job_queue:
+            await job_queue.enqueue(UPDATE_USER, discord_id=msg.content.split(" ")[1])
+            return
         await stock_update_user(
             bot=bot,
             r=r,
             id=msg.content.split(" ")[1].encode("utf-8")
         )
-    elif msg.channel_id == os.getenv("FEEDBACK_CHANNEL") \
-            and msg.author.id == os.getenv("ADMIN_ID") \
-            and msg.message_reference:
+    elif msg.content == "!rebuild_index":
+
+        count = await rebuild_indexes(r=r)
+        await channel.send(f"Indexed {count} users")
+    elif msg.content == "!migrate_storage":
+
+        count = await migrate_tracked_stocks(r=r)
+        await channel.send(f"Converted {count} tracked stocks")
+    elif msg.message_reference:
 
         bot_msg = await channel.get_message(msg.message_reference.message_id.__int__())
 
@@ -232,18 +432,17 @@ async def on_message_create(msg: interactions.Message):
         start, end = text.find("(")+1, text.find(")")
         discord_id = text[start:end]
         if msg.content.lower() == "blacklist":
-            r.hset(
-                discord_id,
-                "USER_SETTINGS.FEEDBACK_BLACKLISTED",
-                1
-            )
+            await set_feedback_blacklisted(r=r, discord_id=discord_id, blacklisted=True)
+            feedback_blacklist.add(int(discord_id))
 
         if msg.content.lower() == "unblacklist":
-            r.hset(
-                discord_id,
-                "USER_SETTINGS.FEEDBACK_BLACKLISTED",
-                0
-            )
+            await set_feedback_blacklisted(r=r, discord_id=discord_id, blacklisted=False)
+            feedback_blacklist.discard(int(discord_id))
+
+
+@bot.event
+async def on_channel_delete(channel: interactions.Channel):
+    get_channel_cache().invalidate(channel.id)
 
 
 @bot.command()
@@ -252,11 +451,27 @@ async def update_me(ctx: interactions.CommandContext):
     printFlush(
         f"`/{update_me.name}` invoked by {ctx.author.name}#{ctx.author.discriminator} ({ctx.author.id})")
 
+    msg = await ctx.send("One moment... This may take several seconds, depending on Yahoo Finance.")
+    await load_stock_modules()
+    from internal.stocks.jobs import UPDATE_USER
+    from internal.stocks.notifications import stock_update_user
+
+    if job_queue:
+        # a worker edits the placeholder once the table is rendered
+        await job_queue.enqueue(
+            UPDATE_USER,
+            discord_id=ctx.author.id.__str__(),
+            channel_id=msg.channel_id.__int__(),
+            message_id=msg.id.__int__(),
+        )
+        printFlush(f"`/{update_me.name} queued")
+        return
+
     await stock_update_user(
         bot=bot,
         r=r,
         id=ctx.author.id.__str__().encode(),
-        msg=await ctx.send("One moment... This may take several seconds, depending on Yahoo Finance.")
+        msg=msg,
     )
     printFlush(f"`/{update_me.name} complete")
 
@@ -266,38 +481,66 @@ async def make_this_my_default_channel(ctx: interactions.CommandContext):
     """Forces the bot to only use this channel when sending weekly notifications."""
     printFlush(
         f"`/{make_this_my_default_channel.name} invoked by {ctx.author} ({ctx.author.id})")
-    r.hset(
-        ctx.author.id.__int__(),
-        "USER_SETTINGS.DEFAULT_CHANNEL",
-        ctx.channel_id.__int__(),
+    await set_default_channel(
+        r=r,
+        discord_id=ctx.author.id.__int__(),
+        channel_id=ctx.channel_id.__int__(),
     )
     await ctx.send("You will now only be pinged here during weekly notifications.", ephemeral=True)
     printFlush(f"`/{make_this_my_default_channel.name} complete")
 
 
+weekly_schedule: asyncio.Task = None
+alert_engine: asyncio.Task = None
+blacklist_refresh: asyncio.Task = None
+metrics_exporters: list[asyncio.Task] = None
+
+
+async def refresh_feedback_blacklist():
+    """Reloads the local blacklist so changes from other processes are picked up."""
+    while True:
+        try:
+            blacklisted = await get_feedback_blacklist(r=r)
+            feedback_blacklist.clear()
+            feedback_blacklist.update(blacklisted)
+        except RedisError as e:
+            printFlush(f"could not refresh the feedback blacklist: {e!r}")
+        await asyncio.sleep(float(os.getenv("BLACKLIST_REFRESH_SECONDS", 300)))
+
+
+async def start_weekly_schedule():
+    await load_stock_modules()
+    from internal.stocks.weekly_schedule import run_weekly_schedule
+    await run_weekly_schedule(bot=bot, r=r, queue=job_queue)
+
+
+async def start_alert_engine():
+    await load_stock_modules()
+    from internal.stocks.alerts import AlertEngine
+    await AlertEngine(bot=bot, r=r).run()
+
+
 @bot.event
 async def on_ready():
-    check_if_friday.start()
-    printFlush("Bot is ready")
-
-
-@tasks.loop(hours=12)
-async def check_if_friday():
-    printFlush(f"Checking if Friday: {date.today().weekday()==4}")
-    if date.today().weekday() == 4 and datetime.utcnow().hour < 21:  # day 4 = Friday
-        check_if_4pm.start()
-        check_if_friday.stop()
-
-
-@tasks.loop(minutes=30)
-async def check_if_4pm():
-    printFlush(f"Checking if 4pm EST: {datetime.utcnow().hour==21}")
-    if datetime.utcnow().hour == 21:  # 21 = 4pm est
-        await send_weekly_notifications(bot=bot, r=r)
-        printFlush("Weekly notification sent")
-        await asyncio.sleep(60*60*24*5)
-        check_if_friday.start()
-        check_if_4pm.stop()
+    global weekly_schedule, alert_engine, blacklist_refresh, metrics_exporters
+    if await indexes_outdated(r=r):
+        printFlush(f"Indexed {await rebuild_indexes(r=r)} users")
+    if blacklist_refresh is None or blacklist_refresh.done():
+        blacklist_refresh = asyncio.create_task(refresh_feedback_blacklist())
+    # on_ready fires again after reconnects; keep a single schedule running.
+    # starting it also begins loading the stock modules in the background
+    if weekly_schedule is None or weekly_schedule.done():
+        weekly_schedule = asyncio.create_task(start_weekly_schedule())
+    alerts_here = os.getenv("ALERTS_ENABLED", "1") != "0" and not job_queue
+    if alerts_here and (alert_engine is None or alert_engine.done()):
+        alert_engine = asyncio.create_task(start_alert_engine())
+    if metrics_exporters is None:
+        metrics_exporters = await start_exporters()
+        ready_after = time.perf_counter() - boot_started
+        metrics.observe("startup", ready_after, phase="ready")
+        printFlush(f"Bot is ready {ready_after:.2f}s after start")
+    else:
+        printFlush("Bot is ready")
 
 
 bot.start()
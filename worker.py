@@ -0,0 +1,40 @@
+
+import asyncio
+import os
+import socket
+
+import interactions
+from dotenv import load_dotenv
+
+from internal.funcs.metrics import start_exporters
+from internal.funcs.printflush import printFlush
+from internal.redis_connector.client import create_redis
+from internal.redis_connector.job_queue import JobQueue
+from internal.stocks import price_cache, price_history
+from internal.stocks.alerts import AlertEngine
+from internal.stocks.jobs import job_handlers
+
+load_dotenv()
+
+
+async def main():
+    # REST calls only; the gateway connection stays with main.py. The client
+    # builds its HTTP client when it logs in, so build it here the same way,
+    # inside the running loop its session binds to
+    bot = interactions.Client(token=os.getenv("TOKEN"))
+    bot._http = interactions.HTTPClient(os.getenv("TOKEN"), bot._cache)
+    r = create_redis()
+    price_cache.attach_redis(r)
+    price_history.attach_redis(r)
+    consumer = os.getenv("DYNO") or f"{socket.gethostname()}-{os.getpid()}"
+
+    background_tasks = await start_exporters()
+    # every worker may poll; the triggered set lets only one send each alert
+    if os.getenv("ALERTS_ENABLED", "1") != "0":
+        background_tasks.append(asyncio.create_task(AlertEngine(bot=bot, r=r).run()))
+
+    printFlush(f"Worker {consumer} is ready")
+    await JobQueue(r).work(consumer, job_handlers(bot=bot, r=r))
+
+
+asyncio.run(main())